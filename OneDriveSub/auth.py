@@ -7,7 +7,8 @@ import logging
 import webbrowser
 import time
 import os
-from config import CLIENT_ID, AUTHORITY, SCOPES
+import tempfile
+from config import CLIENT_ID, AUTHORITY, SCOPES, TOKEN_CACHE_FILE
 
 class OneDriveAuth:
     """
@@ -20,21 +21,37 @@ class OneDriveAuth:
         self.authority = AUTHORITY
         self.scopes = SCOPES
         self.access_token = None
-        self.token_cache_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".token_cache")
+        self.token_cache_file = TOKEN_CACHE_FILE
+        # Token cache and MSAL app are loaded once and reused on token refreshes
+        self._cache = None
+        self._app = None
 
     def _load_cache(self):
         """Load token cache from file if it exists."""
         cache = msal.SerializableTokenCache()
         if os.path.exists(self.token_cache_file):
-            with open(self.token_cache_file, "r") as file:
-                cache.deserialize(file.read())
+            with open(self.token_cache_file, "rb") as file:
+                cache.deserialize(file.read().decode("utf-8"))
         return cache
 
     def _save_cache(self, cache):
-        """Save token cache to file."""
+        """
+        Save token cache to file, if it changed.
+        Written to a temporary file that replaces the cache in one step, so an interrupted
+        save can't leave a truncated cache behind (which would force a new sign-in).
+        """
         if cache.has_state_changed:
-            with open(self.token_cache_file, "w") as file:
-                file.write(cache.serialize())
+            fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(self.token_cache_file) or ".",
+                                             suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as file:
+                    file.write(cache.serialize())
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temp_file, self.token_cache_file)
+            except BaseException:
+                os.unlink(temp_file)
+                raise
 
     def get_token(self):
         """
@@ -42,15 +59,18 @@ class OneDriveAuth:
         First tries to get a token from the cache, then falls back to interactive login.
         """
         try:
-            # Load token cache
-            cache = self._load_cache()
+            if self._app is None:
+                # Load token cache
+                self._cache = self._load_cache()
 
-            # Create the MSAL public client application
-            app = msal.PublicClientApplication(
-                self.client_id,
-                authority=self.authority,
-                token_cache=cache
-            )
+                # Create the MSAL public client application
+                self._app = msal.PublicClientApplication(
+                    self.client_id,
+                    authority=self.authority,
+                    token_cache=self._cache
+                )
+            app = self._app
+            cache = self._cache
 
             # Try to get token from cache first
             accounts = app.get_accounts()
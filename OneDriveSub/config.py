@@ -8,12 +8,13 @@ from pathlib import Path
 BASE_DIR = Path(__file__).resolve().parent
 PARENT_DIR = BASE_DIR.parent
 
-# Local file system settings
+# Local file system settings (absolute, since BASE_DIR is resolved)
 DOWNLOAD_PATH = os.path.join(BASE_DIR, "downloads")
 # Keep the state file in the same directory as the script
 STATE_FILE = os.path.join(BASE_DIR, "onedrive_sync_state.json")
 LOG_FILE = os.path.join(BASE_DIR, "sync.log")
 DEBUG_LOG_FILE = os.path.join(BASE_DIR, "debug.log")
+TOKEN_CACHE_FILE = os.path.join(BASE_DIR, ".token_cache")
 
 # Logging settings
 LOG_LEVEL = "DEBUG"  # Options: DEBUG, INFO, WARNING, ERROR, CRITICAL
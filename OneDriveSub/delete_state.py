@@ -7,7 +7,7 @@ from config import STATE_FILE
 
 def main():
     """Delete the state file."""
-    print(f"Looking for state file at: {os.path.abspath(STATE_FILE)}")
+    print(f"Looking for state file at: {STATE_FILE}")
     
     if os.path.exists(STATE_FILE):
         print(f"State file found. Size: {os.path.getsize(STATE_FILE)} bytes")
@@ -24,7 +24,7 @@ def main():
     # Check for backup files
     backup_file = f"{STATE_FILE}.bak"
     if os.path.exists(backup_file):
-        print(f"Backup state file found at: {os.path.abspath(backup_file)}")
+        print(f"Backup state file found at: {backup_file}")
         
         try:
             os.remove(backup_file)
@@ -35,7 +35,7 @@ def main():
     # Check for temp files
     temp_file = f"{STATE_FILE}.tmp"
     if os.path.exists(temp_file):
-        print(f"Temporary state file found at: {os.path.abspath(temp_file)}")
+        print(f"Temporary state file found at: {temp_file}")
         
         try:
             os.remove(temp_file)
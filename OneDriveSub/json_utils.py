@@ -0,0 +1,41 @@
+"""
+JSON helpers for the state file.
+Uses orjson when it is installed and falls back to the standard library otherwise.
+"""
+import os
+import json
+import mmap
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson.JSONDecodeError is a subclass of json.JSONDecodeError, so callers
+# can keep catching the stdlib exception with either backend
+JSONDecodeError = json.JSONDecodeError
+
+def loads(data):
+    """Parse JSON from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def load_file(path):
+    """
+    Read and parse a JSON file.
+    With orjson the file is memory-mapped and parsed in place instead of being copied
+    into a bytes object first; otherwise it is read with a single unbuffered read.
+    """
+    with open(path, 'rb', buffering=0) as f:
+        # mmap can't map an empty file; reading it gives the usual decode error instead
+        if orjson is not None and os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                return loads(view)
+        return loads(f.read())
+
+def dumps(obj, indent=False):
+    """Serialize an object to UTF-8 encoded JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, indent=2 if indent else None).encode('utf-8')
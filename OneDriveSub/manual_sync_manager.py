@@ -3,13 +3,106 @@ Manual sync manager for handling OneDrive synchronization without using delta AP
 This implementation uses a local state file to track file changes.
 """
 import os
-import json
+import re
 import logging
 import time
 import traceback
 from datetime import datetime
+from collections import deque
+from json_utils import load_file, dumps, JSONDecodeError
 from onedrive_client import OneDriveClient
-from config import STATE_FILE, FILE_TYPES_TO_EXCLUDE, PATHS_TO_EXCLUDE, SYNC_INTERVAL_MINUTES
+from config import STATE_FILE, TOKEN_CACHE_FILE, DOWNLOAD_PATH, FILE_TYPES_TO_EXCLUDE, PATHS_TO_EXCLUDE, SYNC_INTERVAL_MINUTES
+
+# Exclusion rules normalized once so should_process_item does a single C-level check
+_EXCLUDE_EXTS = tuple(ext.lower() for ext in FILE_TYPES_TO_EXCLUDE)
+_EXCLUDE_PATH_RE = (re.compile('|'.join(map(re.escape, PATHS_TO_EXCLUDE)))
+                    if PATHS_TO_EXCLUDE else None)
+
+# Root logger, cached for cheap isEnabledFor checks in the per-item path
+_root_logger = logging.getLogger()
+
+def _stat_or_none(path):
+    """Return os.stat(path), or None if the path does not exist or cannot be read."""
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+def _count_files(root):
+    """Count the files under root using the entry types scandir already reports."""
+    count = 0
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    count += 1
+    return count
+
+def _index_local_files(root):
+    """
+    Map every file under root to its size, keyed by its '/'-separated path relative to root
+    (the same form as the state's path keys). One directory walk replaces a stat per synced file.
+    """
+    index = {}
+    stack = [(root, "")]
+    while stack:
+        path, prefix = stack.pop()
+        try:
+            entries = os.scandir(path)
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, f"{prefix}{entry.name}/"))
+                else:
+                    index[f"{prefix}{entry.name}"] = entry.stat().st_size
+    return index
+
+def _make_download_check(file_state, local_index=None):
+    """
+    Build the check that decides whether a file needs downloading, once per sync.
+    The state lookups are bound as closure variables so the per-file check runs on locals
+    instead of repeated attribute lookups.
+
+    Returns:
+        function: (path_key, file_path, remote_mtime, remote_size) -> reason for downloading
+        the file, or None if the local copy is up to date
+    """
+    get_stored = file_state.get
+    if local_index is not None:
+        get_indexed = local_index.get
+
+        def local_size(path_key, file_path):
+            return get_indexed(path_key)
+    else:
+        def local_size(path_key, file_path):
+            try:
+                return os.stat(file_path).st_size
+            except FileNotFoundError:
+                return None
+
+    def needs_download(path_key, file_path, remote_mtime, remote_size):
+        stored = get_stored(path_key)
+        if stored is None:
+            return "New file found"
+        # If the remote file is newer or different size, download it
+        if remote_mtime and remote_mtime != stored.get('lastModifiedDateTime'):
+            return "File has been modified"
+        if remote_size != stored.get('size', 0):
+            return "File size has changed"
+        # Check the local copy of a file we think is unchanged
+        size = local_size(path_key, file_path)
+        if size is None:
+            return "Local file is missing"
+        if size != remote_size:
+            return "Local file size differs from remote"
+        return None
+
+    return needs_download
 
 class ManualSyncManager:
     """
@@ -17,7 +110,7 @@ class ManualSyncManager:
     Uses a manual state tracking approach instead of delta sync API.
     """
     def __init__(self, check_only=False, test_mode=False, max_files=None, target_folder=None,
-                 root_only=False, force_full_sync=False, force_save_state=False):
+                 root_only=False, force_full_sync=False, force_save_state=False, debug_state=False):
         """
         Initialize the sync manager.
 
@@ -29,70 +122,81 @@ class ManualSyncManager:
             root_only (bool): If True, only download files in the root (not in any folder)
             force_full_sync (bool): If True, ignore existing state and perform full sync
             force_save_state (bool): If True, force saving the state file after sync
+            debug_state (bool): If True, pretty-print the state file for inspection
         """
-        self.client = OneDriveClient()
+        # Created on first use so --show-state and --create-test-state never set up auth or HTTP
+        self._client = None
         self.state_file = STATE_FILE
         self.file_state = {}
         self.last_sync = None
+        # Set when file_state changes, so syncs that changed nothing don't rewrite the state file
+        self._state_dirty = False
+        # Relative path -> size of the local files, built once per full sync
+        self._local_index = None
+        # Per-sync download check built by _make_download_check
+        self._needs_download = None
+        # Parsed state file as read by load_state, reused by show_state
+        self._loaded_state = None
 
         # Sync options
         self.check_only = check_only
         self.test_mode = test_mode
         self.max_files = max_files if test_mode else None
         self.target_folder = target_folder
+        # Normalized "folder/" prefix so process_item needs a single startswith per item
+        # (compared against Graph paths, which always use '/')
+        self._target_prefix = (target_folder.replace('\\', '/').strip('/') + '/'
+                               if target_folder else None)
         self.root_only = root_only
         self.force_full_sync = force_full_sync
         self.force_save_state = force_save_state
+        self.debug_state = debug_state
         self.files_processed = 0
+        # Per-sync outcome counts for the summary line (per-file messages are debug-level)
+        self.sync_counts = {'unchanged': 0, 'downloaded': 0, 'skipped': 0}
 
         logging.debug(f"ManualSyncManager initialized with options: check_only={check_only}, "
                      f"test_mode={test_mode}, max_files={max_files}, target_folder={target_folder}, "
                      f"root_only={root_only}, force_full_sync={force_full_sync}, "
-                     f"force_save_state={force_save_state}")
+                     f"force_save_state={force_save_state}, debug_state={debug_state}")
 
         if not force_full_sync:
             self.load_state()
 
+    @property
+    def client(self):
+        """The OneDrive client, created on first use."""
+        if self._client is None:
+            self._client = OneDriveClient()
+        return self._client
+
     def load_state(self):
         """Load previous sync state including file metadata."""
         try:
             # Check if state file exists
-            if not os.path.exists(self.state_file):
-                logging.info(f"No state file found at: {os.path.abspath(self.state_file)}")
+            st = _stat_or_none(self.state_file)
+            if st is None:
+                logging.info(f"No state file found at: {self.state_file}")
                 logging.info("Will perform full sync.")
                 return False
 
             # Check if state file is empty
-            if os.path.getsize(self.state_file) == 0:
-                logging.warning(f"State file exists but is empty: {os.path.abspath(self.state_file)}")
+            if st.st_size == 0:
+                logging.warning(f"State file exists but is empty: {self.state_file}")
                 logging.info("Will perform full sync.")
                 return False
 
             # Try to load the state file
             try:
-                with open(self.state_file, 'r') as f:
-                    state = json.load(f)
-            except json.JSONDecodeError as e:
+                state = load_file(self.state_file)
+            except JSONDecodeError as e:
                 logging.error(f"State file contains invalid JSON: {str(e)}")
-
-                # Try to load backup if it exists
-                backup_file = f"{self.state_file}.bak"
-                if os.path.exists(backup_file):
-                    logging.info(f"Attempting to load backup state file: {backup_file}")
-                    try:
-                        with open(backup_file, 'r') as f:
-                            state = json.load(f)
-                        logging.info("Successfully loaded backup state file")
-                    except Exception as e2:
-                        logging.error(f"Failed to load backup state file: {str(e2)}")
-                        logging.info("Will perform full sync.")
-                        return False
-                else:
-                    logging.info("No backup state file found. Will perform full sync.")
-                    return False
+                logging.info("Will perform full sync.")
+                return False
 
             # Log the loaded state
-            logging.info(f"Loaded sync state from: {os.path.abspath(self.state_file)}")
+            logging.info(f"Loaded sync state from: {self.state_file}")
+            self._loaded_state = state
 
             # Get file state from state
             self.file_state = state.get("files", {})
@@ -118,8 +222,11 @@ class ManualSyncManager:
     def save_state(self):
         """Save current sync state."""
         try:
+            # The file on disk is about to change
+            self._loaded_state = None
+
             # Log the state file path
-            logging.info(f"Attempting to save sync state to: {os.path.abspath(self.state_file)}")
+            logging.info(f"Attempting to save sync state to: {self.state_file}")
 
             # Create state object
             state = {
@@ -135,75 +242,47 @@ class ManualSyncManager:
                 logging.info(f"Creating directory for state file: {state_dir}")
                 os.makedirs(state_dir, exist_ok=True)
 
-            # First write to a temporary file, then rename to avoid corruption
+            # Write to a temporary file, flushed to disk, then atomically replace the state file.
+            # A crash leaves either the old or the new state, so no backup copy is kept.
             temp_file = f"{self.state_file}.tmp"
             logging.debug(f"Writing state to temporary file: {temp_file}")
 
-            with open(temp_file, 'w') as f:
-                json.dump(state, f, indent=2)  # Use indentation for readability
+            # open()/write() raise on failure, so there is no need to stat or re-read the file afterwards
+            data = dumps(state, indent=self.debug_state)  # Indent only when inspecting the file
+            with open(temp_file, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
 
-            # Verify the temp file was created
-            if not os.path.exists(temp_file):
-                logging.error(f"Failed to create temporary state file at: {temp_file}")
-                return
-
-            # Rename the temp file to the actual state file
-            if os.path.exists(self.state_file):
-                # Create a backup of the existing state file
-                backup_file = f"{self.state_file}.bak"
-                try:
-                    os.replace(self.state_file, backup_file)
-                    logging.debug(f"Created backup of existing state file: {backup_file}")
-                except Exception as e:
-                    logging.warning(f"Could not create backup of state file: {str(e)}")
-
-            # Now rename the temp file to the actual state file
             os.replace(temp_file, self.state_file)
+            self.last_sync = state["last_sync"]
+            self._state_dirty = False
 
-            # Verify the file was created
-            if os.path.exists(self.state_file):
-                file_size = os.path.getsize(self.state_file)
-                logging.info(f"Successfully saved sync state. File size: {file_size} bytes")
-
-                # Read back the file to verify it's valid JSON
-                try:
-                    with open(self.state_file, 'r') as f:
-                        json.load(f)
-                    logging.debug("Verified state file contains valid JSON")
-                except json.JSONDecodeError:
-                    logging.error("State file contains invalid JSON!")
-            else:
-                logging.error(f"Failed to create state file at: {self.state_file}")
+            logging.info(f"Successfully saved sync state. File size: {len(data)} bytes")
 
         except Exception as e:
             logging.error(f"Error saving sync state: {str(e)}")
             logging.debug(f"Stack trace: {traceback.format_exc()}")
 
-            # Try one more time with a simpler approach
-            try:
-                logging.info("Trying fallback method to save state...")
-                with open(self.state_file, 'w') as f:
-                    json.dump({"files": self.file_state, "last_sync": datetime.now().isoformat()}, f)
-                logging.info("Fallback save succeeded")
-            except Exception as e2:
-                logging.error(f"Fallback save also failed: {str(e2)}")
-
-    def should_process_item(self, item):
+    def should_process_item(self, item, parent_path=None):
         """
         Determine if an item should be processed based on exclusion rules.
         """
         # Check file extension exclusions
         name = item.get('name', '')
-        if any(name.lower().endswith(ext.lower()) for ext in FILE_TYPES_TO_EXCLUDE):
-            logging.info(f"Skipping excluded file type: {name}")
+        if _EXCLUDE_EXTS and name.lower().endswith(_EXCLUDE_EXTS):
+            logging.debug("Skipping excluded file type: %s", name)
             return False
 
-        # Check path exclusions
-        parent_path = self.client._get_parent_path(item)
-        full_path = os.path.join(parent_path, name)
-        if any(excl_path in full_path for excl_path in PATHS_TO_EXCLUDE):
-            logging.info(f"Skipping excluded path: {full_path}")
-            return False
+        # Check path exclusions (the parent path is only needed when there are any)
+        if _EXCLUDE_PATH_RE:
+            if parent_path is None:
+                parent_path = self.client._get_parent_path(item)
+            # Graph paths always use '/', so a plain concatenation is enough
+            full_path = f"{parent_path}/{name}" if parent_path else name
+            if _EXCLUDE_PATH_RE.search(full_path):
+                logging.debug("Skipping excluded path: %s", full_path)
+                return False
 
         return True
 
@@ -212,87 +291,93 @@ class ManualSyncManager:
         Process an item (file or folder).
         """
         try:
+            name = item.get('name', '')
+            parent_path = self.client._get_parent_path(item)
+
             # Skip items that match exclusion rules
-            if not self.should_process_item(item):
+            if not self.should_process_item(item, parent_path):
+                self.sync_counts['skipped'] += 1
                 return
 
-            name = item.get('name', '')
-            parent_path = self.client._get_parent_path(item)
-            full_path = os.path.join(parent_path, name) if parent_path else name
+            # The full path is only needed by the target-folder and root-only checks;
+            # joined with '/' like the parent path and the target prefix, on every platform
+            if self._target_prefix or self.root_only:
+                full_path = f"{parent_path}/{name}" if parent_path else name
 
             # Check if we're targeting a specific folder and this item is not in that folder
-            if self.target_folder and not (
-                full_path.startswith(self.target_folder) or
-                parent_path.startswith(self.target_folder) or
-                name == self.target_folder
-            ):
-                logging.debug(f"Skipping item not in target folder: {full_path}")
+            if (self._target_prefix and not full_path.startswith(self._target_prefix)
+                    and full_path != self._target_prefix[:-1]):
+                logging.debug("Skipping item not in target folder: %s", full_path)
                 return
 
             # Check if we only want root files and this item is in a folder
             if self.root_only:
                 # Log the item details for debugging
                 item_type = "Folder" if 'folder' in item else "File"
-                logging.debug(f"Checking root-only for {item_type}: {name}")
-                logging.debug(f"Parent path: '{parent_path}'")
-                logging.debug(f"Full path: '{full_path}'")
+                if _root_logger.isEnabledFor(logging.DEBUG):
+                    logging.debug("Checking root-only for %s: %s", item_type, name)
+                    logging.debug("Parent path: '%s'", parent_path)
+                    logging.debug("Full path: '%s'", full_path)
 
                 # Check if the item is in the root
                 if parent_path:  # If parent_path is not empty, the item is not in the root
-                    logging.debug(f"Skipping non-root item: {full_path}")
+                    logging.debug("Skipping non-root item: %s", full_path)
                     return
 
-                logging.info(f"Found root item: {name} ({item_type})")
+                logging.info("Found root item: %s (%s)", name, item_type)
 
                 # Skip folders if we only want root files
                 if 'folder' in item:
-                    logging.debug(f"Skipping folder in root-only mode: {name}")
+                    logging.debug("Skipping folder in root-only mode: %s", name)
                     return
 
                 # Log the item details for debugging
                 size_bytes = item.get('size', 0)
                 size_mb = size_bytes / (1024 * 1024)
                 size_display = f"{size_mb:.2f} MB" if size_bytes > 0 else "unknown size"
-                logging.info(f"Root file details: {name} ({size_display})")
+                logging.info("Root file details: %s (%s)", name, size_display)
 
             # Check if we've reached the maximum number of files in test mode
             if self.test_mode and self.max_files is not None and self.files_processed >= self.max_files:
-                logging.debug(f"Skipping item due to max files limit: {name}")
+                logging.debug("Skipping item due to max files limit: %s", name)
                 return
 
             # Handle folder
             if 'folder' in item:
-                self.handle_folder(item)
+                self.handle_folder(item, parent_path)
             # Handle file
             elif 'file' in item:
-                self.handle_file(item)
+                self.handle_file(item, parent_path)
                 # Increment the files processed counter if we're in test mode
                 if self.test_mode:
                     self.files_processed += 1
-                    logging.info(f"Processed {self.files_processed}/{self.max_files} files in test mode")
+                    logging.info("Processed %s/%s files in test mode", self.files_processed, self.max_files)
             else:
-                logging.warning(f"Unknown item type: {name}")
+                logging.warning("Unknown item type: %s", name)
 
         except Exception as e:
             logging.error(f"Error processing item {item.get('name', 'unknown')}: {str(e)}")
 
-    def handle_folder(self, item):
+    def handle_folder(self, item, parent_path=None):
         """
         Handle a folder item - create the folder locally if it doesn't exist.
         """
         try:
             name = item.get('name', '')
-            parent_path = self.client._get_parent_path(item)
+            if parent_path is None:
+                parent_path = self.client._get_parent_path(item)
             folder_path = os.path.join(self.client.download_path, parent_path, name)
 
-            if not os.path.exists(folder_path):
-                os.makedirs(folder_path, exist_ok=True)
-                logging.info(f"Created folder: {folder_path}")
+            try:
+                os.makedirs(folder_path)
+                logging.info("Created folder: %s", folder_path)
+            except FileExistsError:
+                pass
 
         except Exception as e:
             logging.error(f"Error handling folder {item.get('name', 'unknown')}: {str(e)}")
 
-    def handle_file(self, item):
+    def handle_file(self, item, parent_path=None):
         """
         Handle a file item - download the file if it's new or modified.
         """
@@ -300,80 +385,53 @@ class ManualSyncManager:
             # Get file metadata
             file_id = item.get('id')
             name = item.get('name', '')
-            parent_path = self.client._get_parent_path(item)
+            if parent_path is None:
+                parent_path = self.client._get_parent_path(item)
             file_path = os.path.join(self.client.download_path, parent_path, name)
             remote_mtime_str = item.get('lastModifiedDateTime')
             size_bytes = item.get('size', 0)
 
-            # Format size for display
-            size_mb = size_bytes / (1024 * 1024)
-            size_display = f"{size_mb:.2f} MB" if size_bytes > 0 else "unknown size"
-
             # Create a unique path key for the state file
             path_key = os.path.join(parent_path, name).replace('\\', '/')
 
             # Check if we need to download this file
-            need_download = False
-
-            # If the file is in our state
-            if path_key in self.file_state:
-                stored_info = self.file_state[path_key]
-                stored_mtime = stored_info.get('lastModifiedDateTime')
-                stored_size = stored_info.get('size', 0)
-
-                # If the remote file is newer or different size, download it
-                if remote_mtime_str and remote_mtime_str != stored_mtime:
-                    logging.info(f"File has been modified: {name}")
-                    need_download = True
-                elif size_bytes != stored_size:
-                    logging.info(f"File size has changed: {name}")
-                    need_download = True
-                else:
-                    logging.info(f"File is unchanged: {name}")
-            else:
-                # File is not in our state, so it's new
-                logging.info(f"New file found: {name}")
-                need_download = True
-
-            # Check if the local file exists and matches what we expect
-            if os.path.exists(file_path) and not need_download:
-                local_size = os.path.getsize(file_path)
-                if local_size != size_bytes:
-                    logging.info(f"Local file size ({local_size}) differs from remote ({size_bytes}): {name}")
-                    need_download = True
+            needs_download = self._needs_download or _make_download_check(self.file_state, self._local_index)
+            reason = needs_download(path_key, file_path, remote_mtime_str, size_bytes)
+            if reason is None:
+                logging.debug("Skipping file (up-to-date): %s", name)
+                self.sync_counts['unchanged'] += 1
+                return
+            logging.info("%s: %s", reason, name)
 
-            # If the local file doesn't exist, we need to download
-            if not os.path.exists(file_path):
-                need_download = True
+            # Format size for display
+            size_mb = size_bytes / (1024 * 1024)
+            size_display = f"{size_mb:.2f} MB" if size_bytes > 0 else "unknown size"
 
             # In check-only mode, just log what would be downloaded
             if self.check_only:
-                if need_download:
-                    logging.info(f"Would download: {name} ({size_display})")
+                logging.info("Would download: %s (%s)", name, size_display)
                 return
 
-            # Download the file if needed
-            if need_download:
-                # In test mode, provide more detailed logging
-                if self.test_mode:
-                    logging.info(f"Test mode - downloading file {self.files_processed+1}/{self.max_files}: {name} ({size_display})")
-                else:
-                    logging.info(f"Downloading file: {name} ({size_display})")
-
-                # Download the file
-                self.client.download_file(item)
-
-                # Update the state with the new file info
-                self.file_state[path_key] = {
-                    'id': file_id,
-                    'name': name,
-                    'lastModifiedDateTime': remote_mtime_str,
-                    'size': size_bytes,
-                    'path': path_key
-                }
-                self.files_processed += 1
+            # In test mode, provide more detailed logging
+            if self.test_mode:
+                logging.info("Test mode - downloading file %s/%s: %s (%s)", self.files_processed+1, self.max_files, name, size_display)
             else:
-                logging.info(f"Skipping file (up-to-date): {name}")
+                logging.info("Downloading file: %s (%s)", name, size_display)
+
+            # Download the file
+            self.client.download_file(item, parent_path)
+
+            # Update the state with the new file info
+            self.file_state[path_key] = {
+                'id': file_id,
+                'name': name,
+                'lastModifiedDateTime': remote_mtime_str,
+                'size': size_bytes,
+                'path': path_key
+            }
+            self._state_dirty = True
+            self.files_processed += 1
+            self.sync_counts['downloaded'] += 1
 
         except Exception as e:
             logging.error(f"Error handling file {item.get('name', 'unknown')}: {str(e)}")
@@ -390,9 +448,13 @@ class ManualSyncManager:
             response = self.client._make_request("me/drive/root/children")
             items = response.get('value', [])
 
-            # Count files and folders
-            root_files = [item for item in items if 'file' in item]
-            root_folders = [item for item in items if 'folder' in item]
+            # Split files and folders in a single pass
+            root_files, root_folders = [], []
+            for item in items:
+                if 'file' in item:
+                    root_files.append(item)
+                elif 'folder' in item:
+                    root_folders.append(item)
 
             logging.info(f"Found {len(root_files)} files and {len(root_folders)} folders in the root")
 
@@ -414,58 +476,55 @@ class ManualSyncManager:
             logging.debug(f"Stack trace: {traceback.format_exc()}")
             return []
 
-    def get_all_files_recursive(self, folder_id="root", path=""):
+    def iter_all_files(self, folder_id="root", path=""):
         """
-        Get all files recursively from OneDrive.
+        Yield all files from OneDrive, walking the folders breadth-first.
+        Files are yielded as each folder is listed, so processing can start before the
+        walk finishes and only the queue of pending folders is kept in memory.
 
         Args:
             folder_id (str): The folder ID to start from
-            path (str): The current path (for logging)
+            path (str): The path of that folder (for logging)
 
-        Returns:
-            list: List of file items
+        Yields:
+            dict: File items
         """
-        all_items = []
-        try:
-            # Get items in the current folder
-            if folder_id == "root":
-                endpoint = "me/drive/root/children"
-            else:
-                endpoint = f"me/drive/items/{folder_id}/children"
+        pending = deque([(folder_id, path)])
+        while pending:
+            folder_id, path = pending.popleft()
+            try:
+                # Get items in the current folder
+                if folder_id == "root":
+                    endpoint = "me/drive/root/children"
+                else:
+                    endpoint = f"me/drive/items/{folder_id}/children"
 
-            response = self.client._make_request(endpoint)
-            items = response.get('value', [])
+                response = self.client._make_request(endpoint)
+                items = response.get('value', [])
+            except Exception as e:
+                logging.error(f"Error getting files from {path or 'root'}: {str(e)}")
+                logging.debug(f"Stack trace: {traceback.format_exc()}")
+                continue
 
-            # Process each item
             for item in items:
-                # If it's a file, add it to our list
+                # If it's a file, hand it out
                 if 'file' in item:
-                    all_items.append(item)
+                    yield item
 
-                # If it's a folder and we're not in root-only mode, process it recursively
+                # If it's a folder and we're not in root-only mode, list it later
                 elif 'folder' in item and not self.root_only:
-                    folder_id = item.get('id')
-                    folder_name = item.get('name', '')
-                    new_path = os.path.join(path, folder_name)
-
-                    # Get items in this folder
-                    folder_items = self.get_all_files_recursive(folder_id, new_path)
-                    all_items.extend(folder_items)
-
-            return all_items
-
-        except Exception as e:
-            logging.error(f"Error getting files from {path or 'root'}: {str(e)}")
-            logging.debug(f"Stack trace: {traceback.format_exc()}")
-            return all_items
+                    pending.append((item.get('id'), os.path.join(path, item.get('name', ''))))
 
     def perform_sync(self):
         """
         Perform a sync with OneDrive using manual state tracking.
         """
         try:
-            # Reset counters
+            # Reset counters (and any local index left by a failed sync)
             self.files_processed = 0
+            self.sync_counts = dict.fromkeys(self.sync_counts, 0)
+            self._local_index = None
+            self._needs_download = None
 
             # Log sync mode
             if self.check_only:
@@ -489,21 +548,35 @@ class ManualSyncManager:
                 # Filter to just files
                 items = [item for item in items if 'file' in item]
             else:
-                # For full sync, get all files recursively
-                items = self.get_all_files_recursive()
+                # For full sync, process files as the folder walk finds them, checking
+                # local copies against one scan of the download folder
+                self._local_index = _index_local_files(self.client.download_path)
+                items = self.iter_all_files()
 
-            # Log what we found
-            total_items = len(items)
-            logging.info(f"Found {total_items} files to process")
+            self._needs_download = _make_download_check(self.file_state, self._local_index)
 
-            # Process each item
-            for i, item in enumerate(items):
-                if i % 10 == 0:  # Log progress every 10 items
-                    logging.info(f"Processing item {i+1}/{total_items}...")
+            # Process items, logging progress every 10 items; counted once processed, so an
+            # item left over when the test-mode limit stops the walk isn't included
+            total_items = 0
+            for item in items:
+                # In test mode, stop walking the drive once enough files were downloaded
+                if self.test_mode and self.max_files is not None and self.files_processed >= self.max_files:
+                    break
+                if total_items % 10 == 0:
+                    logging.info("Processing item %s...", total_items + 1)
                 self.process_item(item)
+                total_items += 1
 
-            # Save the state file
-            self.save_state()
+            # Log what we found
+            logging.info(f"Processed {total_items} files")
+            self._local_index = None
+            self._needs_download = None
+
+            # Save the state file, unless nothing changed since it was last written
+            if self._state_dirty or self.force_save_state or self.last_sync is None:
+                self.save_state()
+            else:
+                logging.info("No changes to the sync state; not rewriting the state file")
 
             # Log summary
             if self.check_only:
@@ -517,6 +590,9 @@ class ManualSyncManager:
             else:
                 logging.info("Sync completed successfully")
                 logging.info(f"Downloaded {self.files_processed} files")
+            logging.info("Sync summary: processed=%s unchanged=%s downloaded=%s skipped=%s",
+                         total_items, self.sync_counts['unchanged'],
+                         self.sync_counts['downloaded'], self.sync_counts['skipped'])
 
             return True
 
@@ -555,54 +631,55 @@ class ManualSyncManager:
             print("\n=== Current Sync State ===\n")
 
             # Check if state file exists
-            if os.path.exists(self.state_file):
-                print(f"State file: {os.path.abspath(self.state_file)}")
-                file_size = os.path.getsize(self.state_file)
-                print(f"File size: {file_size} bytes")
-
-                # Load and display state
-                with open(self.state_file, 'r') as f:
-                    state = json.load(f)
-
-                    # Show last sync time
-                    last_sync = state.get("last_sync", "Never")
-                    print(f"Last sync: {last_sync}")
-
-                    # Show file count
-                    files = state.get("files", {})
-                    print(f"Files tracked: {len(files)}")
-
-                    # Show a sample of files
-                    if files:
-                        print("\nSample of tracked files:")
-                        for i, (path, info) in enumerate(list(files.items())[:5]):
-                            print(f"  {i+1}. {path}")
-                            print(f"     Last modified: {info.get('lastModifiedDateTime', 'unknown')}")
-                            print(f"     Size: {info.get('size', 0)} bytes")
-
-                        if len(files) > 5:
-                            print(f"  ... and {len(files) - 5} more files")
+            st = _stat_or_none(self.state_file)
+            if st is not None:
+                print(f"State file: {self.state_file}")
+                print(f"File size: {st.st_size} bytes")
+
+                # Load and display state (reusing what load_state already parsed)
+                state = self._loaded_state
+                if state is None:
+                    state = load_file(self.state_file)
+
+                # Show last sync time
+                last_sync = state.get("last_sync", "Never")
+                print(f"Last sync: {last_sync}")
+
+                # Show file count
+                files = state.get("files", {})
+                print(f"Files tracked: {len(files)}")
+
+                # Show a sample of files
+                if files:
+                    print("\nSample of tracked files:")
+                    for i, (path, info) in enumerate(list(files.items())[:5]):
+                        print(f"  {i+1}. {path}")
+                        print(f"     Last modified: {info.get('lastModifiedDateTime', 'unknown')}")
+                        print(f"     Size: {info.get('size', 0)} bytes")
+
+                    if len(files) > 5:
+                        print(f"  ... and {len(files) - 5} more files")
             else:
-                print(f"No state file found at: {os.path.abspath(self.state_file)}")
+                print(f"No state file found at: {self.state_file}")
                 print("A full sync will be performed on the next run.")
 
             # Show token cache information
-            token_cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".token_cache")
-            if os.path.exists(token_cache_path):
+            token_cache_path = TOKEN_CACHE_FILE
+            st = _stat_or_none(token_cache_path)
+            if st is not None:
                 print(f"\nToken cache: {token_cache_path}")
-                file_size = os.path.getsize(token_cache_path)
-                print(f"Token cache size: {file_size} bytes")
+                print(f"Token cache size: {st.st_size} bytes")
             else:
                 print("\nNo token cache found. Authentication will be required on next run.")
 
             # Show download directory information
-            download_path = self.client.download_path
+            download_path = DOWNLOAD_PATH
             if os.path.exists(download_path):
-                print(f"\nDownload directory: {os.path.abspath(download_path)}")
-                file_count = sum([len(files) for _, _, files in os.walk(download_path)])
+                print(f"\nDownload directory: {download_path}")
+                file_count = _count_files(download_path)
                 print(f"Files in download directory: {file_count}")
             else:
-                print(f"\nDownload directory does not exist: {os.path.abspath(download_path)}")
+                print(f"\nDownload directory does not exist: {download_path}")
 
             print("\n=== End of Sync State ===\n")
 
@@ -642,7 +719,7 @@ class ManualSyncManager:
 
             # Verify the file was created
             if os.path.exists(self.state_file):
-                logging.info(f"Test state file created successfully at: {os.path.abspath(self.state_file)}")
+                logging.info(f"Test state file created successfully at: {self.state_file}")
                 return True
             else:
                 logging.error(f"Failed to create test state file")
@@ -2,14 +2,54 @@
 OneDrive client for interacting with Microsoft Graph API.
 """
 import requests
+from requests.adapters import HTTPAdapter
 import os
-import json
+import shutil
 import logging
 import traceback
 from urllib.parse import urlparse
+from json_utils import loads
 from auth import OneDriveAuth
 from config import GRAPH_BASE_URL, DOWNLOAD_PATH
 
+# Root logger, cached for cheap isEnabledFor checks in the per-item path
+_root_logger = logging.getLogger()
+
+def _part_offset(part_path, tag_path, remote_size, remote_tag):
+    """
+    Get the size of a .part file left by an earlier download, to resume from, or 0.
+    The .tag file next to it holds the eTag of the version being downloaded; a .part
+    file of another (or an unknown) version is deleted instead of resumed.
+    """
+    if not os.path.exists(part_path):
+        return 0
+    try:
+        with open(tag_path) as f:
+            part_tag = f.read()
+    except FileNotFoundError:
+        part_tag = None
+    offset = os.path.getsize(part_path)
+    if remote_tag and part_tag == remote_tag and remote_size and offset < remote_size:
+        return offset
+    _remove_files(part_path, tag_path)
+    return 0
+
+def _write_part_tag(tag_path, tag):
+    """Record which version of a file its .part file holds."""
+    if tag:
+        with open(tag_path, 'w') as f:
+            f.write(tag)
+    else:
+        _remove_files(tag_path)
+
+def _remove_files(*paths):
+    """Delete files, ignoring ones that don't exist."""
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
 class OneDriveClient:
     """
     Client for interacting with OneDrive via Microsoft Graph API.
@@ -22,13 +62,17 @@ class OneDriveClient:
         self.download_path = DOWNLOAD_PATH
         self.drive_id = None
 
+        # One keep-alive session for all Graph and download requests
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
     def _make_request(self, endpoint, method="GET", params=None, data=None, stream=False):
         """Make a request to the Microsoft Graph API."""
         url = f"{self.base_url}/{endpoint}"
         headers = self.auth.get_headers()
 
         try:
-            response = requests.request(
+            response = self.session.request(
                 method=method,
                 url=url,
                 headers=headers,
@@ -42,7 +86,7 @@ class OneDriveClient:
                 # Token expired, get a new one
                 self.auth.access_token = None
                 headers = self.auth.get_headers()
-                response = requests.request(
+                response = self.session.request(
                     method=method,
                     url=url,
                     headers=headers,
@@ -55,7 +99,8 @@ class OneDriveClient:
             response.raise_for_status()
 
             if method == "GET" and not stream and response.content:
-                return response.json()
+                # Parse the raw bytes with the fast JSON backend (delta pages can be several MB)
+                return loads(response.content)
             return response
 
         except requests.exceptions.RequestException as e:
@@ -214,9 +259,10 @@ class OneDriveClient:
             logging.error(f"Error getting items: {str(e)}")
             raise
 
-    def download_file(self, item):
+    def download_file(self, item, parent_path=None):
         """
         Download a file from OneDrive.
+        Callers that already resolved the item's parent path can pass it to avoid recomputing it.
         """
         try:
             # Get download URL
@@ -232,7 +278,8 @@ class OneDriveClient:
                     raise Exception(f"Could not get download URL for file: {item.get('name')}")
 
             # Get the relative path of the file
-            parent_path = self._get_parent_path(item)
+            if parent_path is None:
+                parent_path = self._get_parent_path(item)
             file_name = item.get('name')
 
             # Create local directory structure if it doesn't exist
@@ -242,13 +289,38 @@ class OneDriveClient:
             # Download the file
             local_file_path = os.path.join(local_dir, file_name)
 
+            # Written to a .part file that replaces the local file once complete
+            part_path = local_file_path + '.part'
+            tag_path = part_path + '.tag'
+            remote_size = item.get('size')
+            remote_tag = item.get('eTag') or item.get('cTag')
+            offset = _part_offset(part_path, tag_path, remote_size, remote_tag)
+
             # Stream download
-            response = requests.get(download_url, stream=True)
+            headers = {'Range': f'bytes={offset}-', 'If-Range': remote_tag} if offset else None
+            response = self.session.get(download_url, stream=True, headers=headers)
             response.raise_for_status()
 
-            with open(local_file_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+            if offset and response.status_code != 206:
+                # The server sent the whole file
+                offset = 0
+            elif offset:
+                logging.info(f"Resuming download of {file_name} from byte {offset}")
+
+            # Copy in 1 MiB blocks in C; the file is unbuffered since the blocks are already large
+            response.raw.decode_content = True
+            with open(part_path, 'ab' if offset else 'wb', buffering=0) as f:
+                if not offset:
+                    _write_part_tag(tag_path, remote_tag)
+                shutil.copyfileobj(response.raw, f, length=1024 * 1024)
+                written = f.tell()
+                os.fsync(f.fileno())
+
+            if remote_size and written != remote_size:
+                _remove_files(part_path, tag_path)
+                raise Exception(f"Downloaded size {written} does not match expected size {remote_size}")
+            os.replace(part_path, local_file_path)
+            _remove_files(tag_path)
 
             logging.info(f"Downloaded: {local_file_path}")
             return local_file_path
@@ -264,22 +336,26 @@ class OneDriveClient:
         try:
             parent_reference = item.get('parentReference', {})
             path = parent_reference.get('path', '')
-            name = item.get('name', 'unknown')
+            debug = _root_logger.isEnabledFor(logging.DEBUG)
 
             # Log the raw path for debugging
-            logging.debug(f"Raw parent path for '{name}': {path}")
+            if debug:
+                name = item.get('name', 'unknown')
+                logging.debug("Raw parent path for '%s': %s", name, path)
 
             # The path is usually in the format "/drive/root:/path/to/parent"
             if ':' in path:
                 path = path.split(':')[-1]
-                logging.debug(f"After splitting at colon: {path}")
+                if debug:
+                    logging.debug("After splitting at colon: %s", path)
 
             # Remove leading slash
             path = path.lstrip('/')
 
             # Log whether this is a root item
-            is_root = (path == '')
-            logging.debug(f"Item '{name}' is {'in root' if is_root else 'not in root'} (path: '{path}')")
+            if debug:
+                location = 'in root' if path == '' else 'not in root'
+                logging.debug("Item '%s' is %s (path: '%s')", name, location, path)
 
             return path
 
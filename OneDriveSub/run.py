@@ -56,8 +56,8 @@ def setup_logging():
     logging.info(f"Python version: {sys.version}")
     logging.info(f"Operating system: {os.name}")
     logging.info(f"Log level: {LOG_LEVEL}")
-    logging.info(f"Regular log file: {os.path.abspath(LOG_FILE)}")
-    logging.info(f"Debug log file: {os.path.abspath(DEBUG_LOG_FILE)}")
+    logging.info(f"Regular log file: {LOG_FILE}")
+    logging.info(f"Debug log file: {DEBUG_LOG_FILE}")
     logging.debug("Debug logging is enabled")
 
 def main():
@@ -75,6 +75,7 @@ def main():
     parser.add_argument('--force-full-sync', action='store_true', help='Force a full sync by ignoring the existing state file')
     parser.add_argument('--show-state', action='store_true', help='Show the current sync state and exit')
     parser.add_argument('--force-save-state', action='store_true', help='Force saving the state file after sync')
+    parser.add_argument('--debug-state', action='store_true', help='Write the state file pretty-printed (slower, for debugging)')
     args = parser.parse_args()
 
     # Set up logging
@@ -94,7 +95,8 @@ def main():
             'target_folder': args.folder,
             'root_only': args.root_only,
             'force_full_sync': args.force_full_sync,
-            'force_save_state': args.force_save_state
+            'force_save_state': args.force_save_state,
+            'debug_state': args.debug_state
         }
 
         # Log the sync options
@@ -140,12 +142,12 @@ def main():
             logging.info("Forcing state file to be saved after sync")
 
         # Log the state file path
-        state_file_path = os.path.abspath(sync_manager.state_file)
+        state_file_path = sync_manager.state_file
         logging.info(f"Using state file: {state_file_path}")
-        if os.path.exists(state_file_path):
-            state_file_size = os.path.getsize(state_file_path)
+        try:
+            state_file_size = os.stat(state_file_path).st_size
             logging.info(f"State file exists. Size: {state_file_size} bytes")
-        else:
+        except OSError:
             logging.info("State file does not exist yet. Will be created after successful sync.")
 
         # Run the sync
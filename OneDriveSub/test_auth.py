@@ -3,22 +3,93 @@ Simple script to test authentication with Microsoft Graph API.
 """
 import os
 import sys
-import msal
-import requests
-import json
+import shutil
+from json_utils import loads
 
 # Microsoft Graph API settings
 CLIENT_ID = "4a1aa1d5-c567-49d0-ad0b-cd957a47f842"  # Microsoft Graph Explorer client ID
 AUTHORITY = "https://login.microsoftonline.com/common"  # Works for personal accounts
 SCOPES = ["User.Read", "Files.Read", "Files.Read.All"]  # Scopes for file access
 GRAPH_BASE_URL = "https://graph.microsoft.com/v1.0"
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+TOKEN_CACHE_PATH = os.path.join(SCRIPT_DIR, ".token_cache")
+
+# Shared between the tests so the token cache is read once, MSAL is initialized
+# once and HTTP connections to Graph are kept alive. msal and requests are only
+# imported by the tests that need them, so clearing the cache stays fast.
+_session = None
+_cache = None
+_app = None
+_token = None
+
+def _get_session():
+    """Create the shared HTTP session on first use."""
+    global _session
+    if _session is None:
+        import requests
+        _session = requests.Session()
+    return _session
+
+def _get_app():
+    """Load the token cache and create the MSAL application on first use."""
+    global _cache, _app
+    if _app is None:
+        import msal
+        _cache = msal.SerializableTokenCache()
+        if os.path.exists(TOKEN_CACHE_PATH):
+            with open(TOKEN_CACHE_PATH, "rb") as file:
+                _cache.deserialize(file.read().decode("utf-8"))
+        _app = msal.PublicClientApplication(
+            CLIENT_ID,
+            authority=AUTHORITY,
+            token_cache=_cache
+        )
+    return _app
+
+def _save_cache():
+    """Write the token cache back to disk if it changed. Returns True if it was written."""
+    if _cache is not None and _cache.has_state_changed:
+        with open(TOKEN_CACHE_PATH, "w") as file:
+            file.write(_cache.serialize())
+        return True
+    return False
+
+def _use_token(token):
+    """Remember the access token and send it with every request on the shared session."""
+    global _token
+    _token = token
+    _get_session().headers.update({
+        "Authorization": f"Bearer {token}",
+        "Accept": "application/json"
+    })
+    return token
+
+def _get_token():
+    """Get an access token silently from the cache, reusing it across tests."""
+    if _token is None:
+        app = _get_app()
+        accounts = app.get_accounts()
+        if not accounts:
+            print("❌ No accounts found in cache. Please run authentication test first.")
+            return None
+
+        result = app.acquire_token_silent(SCOPES, account=accounts[0])
+        if not result:
+            print("❌ Failed to acquire token silently. Please run authentication test first.")
+            return None
+
+        _use_token(result['access_token'])
+    return _token
 
 def clear_token_cache():
     """Clear the token cache file."""
-    token_cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".token_cache")
-    if os.path.exists(token_cache_path):
-        os.remove(token_cache_path)
-        print(f"Token cache cleared: {token_cache_path}")
+    global _cache, _app, _token
+    _cache = _app = _token = None
+    if _session is not None:
+        _session.headers.pop("Authorization", None)
+    if os.path.exists(TOKEN_CACHE_PATH):
+        os.remove(TOKEN_CACHE_PATH)
+        print(f"Token cache cleared: {TOKEN_CACHE_PATH}")
     else:
         print("No token cache found.")
 
@@ -28,21 +99,13 @@ def test_authentication():
         print("\n=== Testing Authentication ===\n")
         
         # Load token cache
-        cache = msal.SerializableTokenCache()
-        token_cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".token_cache")
-        if os.path.exists(token_cache_path):
-            with open(token_cache_path, "r") as file:
-                cache.deserialize(file.read())
-            print(f"Token cache loaded from: {token_cache_path}")
+        if os.path.exists(TOKEN_CACHE_PATH):
+            print(f"Token cache loaded from: {TOKEN_CACHE_PATH}")
         else:
             print("No token cache found. Will perform interactive authentication.")
         
         # Create the MSAL public client application
-        app = msal.PublicClientApplication(
-            CLIENT_ID,
-            authority=AUTHORITY,
-            token_cache=cache
-        )
+        app = _get_app()
         
         # Try to get token from cache first
         accounts = app.get_accounts()
@@ -56,34 +119,26 @@ def test_authentication():
             
             if result:
                 print("✅ Successfully acquired token from cache.")
-                token = result['access_token']
+                token = _use_token(result['access_token'])
                 token_preview = token[:10] + "..." + token[-10:]
                 print(f"Token preview: {token_preview}")
                 
                 # Test the token with a simple Graph API call
                 print("\nTesting token with Graph API call to /me...")
                 
-                headers = {
-                    "Authorization": f"Bearer {token}",
-                    "Accept": "application/json"
-                }
-                
-                response = requests.get(
-                    f"{GRAPH_BASE_URL}/me",
-                    headers=headers
+                response = _get_session().get(
+                    f"{GRAPH_BASE_URL}/me"
                 )
                 
                 if response.status_code == 200:
-                    user_data = response.json()
+                    user_data = loads(response.content)
                     print(f"✅ Token works! User: {user_data.get('displayName')} ({user_data.get('userPrincipalName')})")
                 else:
                     print(f"❌ Token doesn't work. Status code: {response.status_code}")
                     print(f"Response: {response.text}")
                 
                 # Save cache
-                if cache.has_state_changed:
-                    with open(token_cache_path, "w") as file:
-                        file.write(cache.serialize())
+                if _save_cache():
                     print(f"Token cache updated.")
                 
                 return True
@@ -92,61 +147,64 @@ def test_authentication():
         else:
             print("No accounts found in cache.")
         
-        # If no token in cache or expired, try device code flow
-        print("\nAttempting device code flow...")
-        flow = app.initiate_device_flow(scopes=SCOPES)
-        
-        if "user_code" in flow:
-            # Print the message with the code for the user
-            print("\n" + flow["message"])
-            print("\nWaiting for you to complete the authentication in your browser...")
+        # Before prompting, try to redeem any refresh token left in the cache
+        result = None
+        from msal import TokenCache
+        for refresh_token in _cache.find(TokenCache.CredentialType.REFRESH_TOKEN):
+            print("\nAttempting to refresh token from cache...")
+            result = app.acquire_token_by_refresh_token(refresh_token["secret"], SCOPES)
+            if "access_token" in result:
+                break
+            result = None
+        
+        if result is None:
+            # If no refresh token worked either, try device code flow
+            print("\nAttempting device code flow...")
+            flow = app.initiate_device_flow(scopes=SCOPES)
+        
+            if "user_code" in flow:
+                # Print the message with the code for the user
+                print("\n" + flow["message"])
+                print("\nWaiting for you to complete the authentication in your browser...")
             
-            # Try to open the verification URL automatically
-            try:
-                import webbrowser
-                webbrowser.open(flow["verification_uri"])
-            except:
-                pass
+                # Try to open the verification URL automatically
+                try:
+                    import webbrowser
+                    webbrowser.open(flow["verification_uri"])
+                except:
+                    pass
             
-            # Complete the flow by waiting for the user to enter the code
-            result = app.acquire_token_by_device_flow(flow)
-        else:
-            # If device code flow fails, fall back to interactive login
-            print("\nDevice code flow failed. Attempting interactive login...")
-            print("You will be redirected to your browser to sign in with your Microsoft account.")
-            result = app.acquire_token_interactive(SCOPES)
+                # Complete the flow by waiting for the user to enter the code
+                result = app.acquire_token_by_device_flow(flow)
+            else:
+                # If device code flow fails, fall back to interactive login
+                print("\nDevice code flow failed. Attempting interactive login...")
+                print("You will be redirected to your browser to sign in with your Microsoft account.")
+                result = app.acquire_token_interactive(SCOPES)
         
         if "access_token" in result:
-            print("\n✅ Successfully acquired token through interactive login.")
-            token = result['access_token']
+            print("\n✅ Successfully acquired token.")
+            token = _use_token(result['access_token'])
             token_preview = token[:10] + "..." + token[-10:]
             print(f"Token preview: {token_preview}")
             
             # Test the token with a simple Graph API call
             print("\nTesting token with Graph API call to /me...")
             
-            headers = {
-                "Authorization": f"Bearer {token}",
-                "Accept": "application/json"
-            }
-            
-            response = requests.get(
-                f"{GRAPH_BASE_URL}/me",
-                headers=headers
+            response = _get_session().get(
+                f"{GRAPH_BASE_URL}/me"
             )
             
             if response.status_code == 200:
-                user_data = response.json()
+                user_data = loads(response.content)
                 print(f"✅ Token works! User: {user_data.get('displayName')} ({user_data.get('userPrincipalName')})")
             else:
                 print(f"❌ Token doesn't work. Status code: {response.status_code}")
                 print(f"Response: {response.text}")
             
             # Save cache
-            if cache.has_state_changed:
-                with open(token_cache_path, "w") as file:
-                    file.write(cache.serialize())
-                print(f"Token cache saved to: {token_cache_path}")
+            if _save_cache():
+                print(f"Token cache saved to: {TOKEN_CACHE_PATH}")
             
             return True
         else:
@@ -167,61 +225,36 @@ def test_root_files():
         print("\n=== Testing Root Files Access ===\n")
         
         # Get token
-        cache = msal.SerializableTokenCache()
-        token_cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".token_cache")
-        if os.path.exists(token_cache_path):
-            with open(token_cache_path, "r") as file:
-                cache.deserialize(file.read())
-        
-        app = msal.PublicClientApplication(
-            CLIENT_ID,
-            authority=AUTHORITY,
-            token_cache=cache
-        )
-        
-        accounts = app.get_accounts()
-        if not accounts:
-            print("❌ No accounts found in cache. Please run authentication test first.")
-            return False
-        
-        result = app.acquire_token_silent(SCOPES, account=accounts[0])
-        if not result:
-            print("❌ Failed to acquire token silently. Please run authentication test first.")
+        if not _get_token():
             return False
         
-        token = result['access_token']
-        
-        # Set up headers
-        headers = {
-            'Authorization': f'Bearer {token}',
-            'Content-Type': 'application/json'
-        }
-        
         # Get items in the root folder
         print("Getting items in the root folder...")
-        response = requests.get(
-            f"{GRAPH_BASE_URL}/me/drive/root/children",
-            headers=headers
+        response = _get_session().get(
+            f"{GRAPH_BASE_URL}/me/drive/root/children"
         )
         
         if response.status_code == 200:
             # Parse response
-            items = response.json().get('value', [])
+            items = loads(response.content).get('value', [])
             
-            # Filter for files only (not folders)
-            files = [item for item in items if 'file' in item]
-            folders = [item for item in items if 'folder' in item]
+            # Split files and folders in a single pass
+            files, folders = [], []
+            for item in items:
+                if 'file' in item:
+                    files.append(item)
+                elif 'folder' in item:
+                    folders.append(item)
             
             print(f"✅ Successfully retrieved root items: {len(files)} files and {len(folders)} folders")
             
             # Print list of files
             if files:
                 print("\nFiles in the root:")
-                for i, file in enumerate(files):
-                    name = file.get('name', 'unknown')
-                    size = file.get('size', 0)
-                    size_mb = size / (1024 * 1024)
-                    print(f"  {i+1}. {name} ({size_mb:.2f} MB)")
+                # Build the whole listing and write it once instead of one print per file
+                lines = ["  {}. {} ({:.2f} MB)".format(i, file.get('name', 'unknown'), file.get('size', 0) / (1024 * 1024))
+                         for i, file in enumerate(files, 1)]
+                print("\n".join(lines))
             else:
                 print("\nNo files found in the root.")
             
@@ -243,41 +276,13 @@ def test_download_capability():
         print("\n=== Testing Download Capability ===\n")
         
         # Get token
-        cache = msal.SerializableTokenCache()
-        token_cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".token_cache")
-        if os.path.exists(token_cache_path):
-            with open(token_cache_path, "r") as file:
-                cache.deserialize(file.read())
-        
-        app = msal.PublicClientApplication(
-            CLIENT_ID,
-            authority=AUTHORITY,
-            token_cache=cache
-        )
-        
-        accounts = app.get_accounts()
-        if not accounts:
-            print("❌ No accounts found in cache. Please run authentication test first.")
-            return False
-        
-        result = app.acquire_token_silent(SCOPES, account=accounts[0])
-        if not result:
-            print("❌ Failed to acquire token silently. Please run authentication test first.")
+        if not _get_token():
             return False
         
-        token = result['access_token']
-        
-        # Set up headers
-        headers = {
-            'Authorization': f'Bearer {token}',
-            'Content-Type': 'application/json'
-        }
-        
         # Get items in the root folder
         print("Getting items in the root folder...")
-        response = requests.get(
-            f"{GRAPH_BASE_URL}/me/drive/root/children",
-            headers=headers
+        response = _get_session().get(
+            f"{GRAPH_BASE_URL}/me/drive/root/children"
         )
         
         if response.status_code != 200:
@@ -286,17 +291,21 @@ def test_download_capability():
             return False
         
         # Parse response
-        items = response.json().get('value', [])
-        
-        # Filter for files only (not folders)
-        files = [item for item in items if 'file' in item]
-        
-        if not files:
+        items = loads(response.content).get('value', [])
+        
+        # Find the smallest file (not folder) to test download in a single pass
+        smallest_file = None
+        smallest_size = float('inf')
+        for item in items:
+            if 'file' in item:
+                item_size = item.get('size', float('inf'))
+                if smallest_file is None or item_size < smallest_size:
+                    smallest_file, smallest_size = item, item_size
+        
+        if smallest_file is None:
             print("❌ No files found in the root to test download.")
             return False
         
-        # Find the smallest file to test download
-        smallest_file = min(files, key=lambda x: x.get('size', float('inf')))
         name = smallest_file.get('name', 'unknown')
         size = smallest_file.get('size', 0)
         size_mb = size / (1024 * 1024)
@@ -306,9 +315,8 @@ def test_download_capability():
         
         # Get download URL
         print(f"Getting download URL...")
-        response = requests.get(
-            f"{GRAPH_BASE_URL}/me/drive/items/{file_id}",
-            headers=headers
+        response = _get_session().get(
+            f"{GRAPH_BASE_URL}/me/drive/items/{file_id}"
         )
         
         if response.status_code != 200:
@@ -316,18 +324,18 @@ def test_download_capability():
             print(f"Response: {response.text}")
             return False
         
-        download_url = response.json().get('@microsoft.graph.downloadUrl')
+        download_url = loads(response.content).get('@microsoft.graph.downloadUrl')
         if not download_url:
             print(f"❌ Could not get download URL for file: {name}")
             return False
         
         # Create test download directory
-        test_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_download")
+        test_dir = os.path.join(SCRIPT_DIR, "test_download")
         os.makedirs(test_dir, exist_ok=True)
         
-        # Download the file
+        # Download the file (the download URL is pre-authenticated, so don't send the bearer token)
         print(f"Downloading file...")
-        response = requests.get(download_url, stream=True)
+        response = _get_session().get(download_url, stream=True, headers={"Authorization": None})
         
         if response.status_code != 200:
             print(f"❌ Failed to download file. Status code: {response.status_code}")
@@ -335,9 +343,9 @@ def test_download_capability():
         
         # Save the file
         file_path = os.path.join(test_dir, name)
+        response.raw.decode_content = True
         with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+            shutil.copyfileobj(response.raw, f, length=1024 * 1024)
         
         # Verify the file was downloaded
         if os.path.exists(file_path):
@@ -1,9 +1,10 @@
 """
 Authentication module for Microsoft Graph API using client credentials flow.
 """
+import time
 import msal
 import logging
-from config import TENANT_ID, CLIENT_ID, CLIENT_SECRET, CLIENT_SECRET_ID
+from config import TENANT_ID, CLIENT_ID, CLIENT_SECRET
 
 class SharePointAuth:
     """
@@ -11,28 +12,32 @@ class SharePointAuth:
     This is suitable for organizational scenarios where you have registered an application
     with client ID and secret.
     """
+    # MSAL applications keyed by (tenant_id, client_id, client_secret), built once and shared
+    # by all instances so MSAL's in-memory token cache survives between calls
+    _app_cache = {}
+
     def __init__(self):
         """Initialize the authentication handler."""
         self.tenant_id = TENANT_ID
         self.client_id = CLIENT_ID
         self.client_secret = CLIENT_SECRET
-        self.client_secret_id = CLIENT_SECRET_ID
         self.authority = f"https://login.microsoftonline.com/{self.tenant_id}"
         self.scope = ["https://graph.microsoft.com/.default"]
         self.access_token = None
+        self._token_expiry = 0
 
-    def get_token(self):
+    def get_token(self, force_refresh=False):
         """
         Get an access token for Microsoft Graph API using client credentials flow.
         This method is suitable for service applications running without user interaction.
+        force_refresh gets a new token even if the current one hasn't expired, e.g. after
+        the API rejected it.
         """
-        try:
-            # Log the authentication parameters (without the secret)
-            logging.debug(f"Authenticating with tenant ID: {self.tenant_id}")
-            logging.debug(f"Client ID: {self.client_id}")
-            logging.debug(f"Authority: {self.authority}")
-            logging.debug(f"Scopes: {self.scope}")
+        # Reuse the current token until it is about to expire
+        if not force_refresh and self.access_token and self._token_expiry - time.time() > 60:
+            return self.access_token
 
+        try:
             # Validate credentials
             if not self.tenant_id or self.tenant_id == "your_tenant_id":
                 raise ValueError("Invalid tenant ID. Please check your .env file.")
@@ -40,72 +45,25 @@ class SharePointAuth:
                 raise ValueError("Invalid client ID. Please check your .env file.")
             if not self.client_secret or self.client_secret == "your_client_secret":
                 raise ValueError("Invalid client secret. Please check your .env file.")
-            if not self.client_secret_id or self.client_secret_id == "your_client_secret_id":
-                raise ValueError("Invalid client secret ID. Please check your .env file.")
-
-            # Create the MSAL confidential client application
-            logging.debug("Creating MSAL application with client ID and credentials")
 
-            # Try different credential formats based on what might be expected
-            try:
-                # First attempt: Use just the client secret (most common format)
-                logging.debug("Attempting authentication with client secret only")
-                app = msal.ConfidentialClientApplication(
-                    self.client_id,
-                    authority=self.authority,
-                    client_credential=self.client_secret  # Just the secret as a string
-                )
-            except Exception as e:
-                logging.debug(f"First authentication attempt failed: {str(e)}")
-
-                try:
-                    # Second attempt: Use the secret ID as the secret
-                    logging.debug("Attempting authentication with client secret ID as the secret")
-                    app = msal.ConfidentialClientApplication(
-                        self.client_id,
-                        authority=self.authority,
-                        client_credential=self.client_secret_id  # Using the secret ID as the secret
-                    )
-                except Exception as e:
-                    logging.debug(f"Second authentication attempt failed: {str(e)}")
-
-                    try:
-                        # Third attempt: Use a dictionary with the expected format
-                        logging.debug("Attempting authentication with credential dictionary")
-                        client_credential = {
-                            "secret": self.client_secret,
-                            "secret_id": self.client_secret_id
-                        }
-                        app = msal.ConfidentialClientApplication(
-                            self.client_id,
-                            authority=self.authority,
-                            client_credential=client_credential
-                        )
-                    except Exception as e:
-                        logging.debug(f"Third authentication attempt failed: {str(e)}")
-
-                        # Final attempt: Try another dictionary format
-                        logging.debug("Attempting authentication with alternative credential format")
-                        client_credential = {
-                            "clientSecret": self.client_secret,
-                            "clientSecretId": self.client_secret_id
-                        }
-                        app = msal.ConfidentialClientApplication(
-                            self.client_id,
-                            authority=self.authority,
-                            client_credential=client_credential
-                        )
+            # A new app starts with an empty token cache, so MSAL can't hand back the
+            # rejected token
+            key = (self.tenant_id, self.client_id, self.client_secret)
+            app = None if force_refresh else self._app_cache.get(key)
+            if app is None:
+                app = self._create_app()
+                self._app_cache[key] = app
 
             # Acquire token for client
-            logging.debug("Requesting access token...")
             result = app.acquire_token_for_client(scopes=self.scope)
 
             if "access_token" in result:
                 self.access_token = result['access_token']
+                self._token_expiry = time.time() + result.get("expires_in", 0)
                 logging.info("Successfully acquired access token")
                 # Log a small portion of the token for debugging
-                token_preview = self.access_token[:10] + "..." + self.access_token[-10:]
-                logging.debug(f"Token preview: {token_preview}")
+                if logging.getLogger().isEnabledFor(logging.DEBUG):
+                    logging.debug("Token preview: %s...%s", self.access_token[:10], self.access_token[-10:])
                 return self.access_token
             else:
                 error_description = result.get("error_description", "Unknown error")
@@ -126,10 +84,17 @@ class SharePointAuth:
             logging.error(f"Error during authentication: {str(e)}")
             raise
 
-    def get_headers(self):
+    def _create_app(self):
+        """Create the MSAL confidential client application."""
+        return msal.ConfidentialClientApplication(
+            self.client_id,
+            authority=self.authority,
+            client_credential=self.client_secret
+        )
+
+    def get_headers(self, force_refresh=False):
         """Get the authorization headers for API requests."""
-        if not self.access_token:
-            self.get_token()
+        self.get_token(force_refresh)
 
         return {
             'Authorization': f'Bearer {self.access_token}',
@@ -2,6 +2,7 @@
 Configuration settings for the Organizational SharePoint Sync Tool.
 """
 import os
+import re
 from pathlib import Path
 
 # Base directory
@@ -9,12 +10,16 @@ BASE_DIR = Path(__file__).resolve().parent
 PARENT_DIR = BASE_DIR.parent
 
 # Local file system settings
-DOWNLOAD_PATH = os.path.join(BASE_DIR, "downloads")
-STATE_FILE = os.path.join(BASE_DIR, "sync_state.json")
-LOG_FILE = os.path.join(BASE_DIR, "sync.log")
+# Kept as resolved Path objects so callers never need to re-normalize them
+DOWNLOAD_PATH = BASE_DIR / "downloads"
+STATE_FILE = BASE_DIR / "sync_state.json"
+STATE_DB_FILE = BASE_DIR / "sync_state.db"  # Manual sync state (SQLite); replaces the JSON state file
+DELTA_STATE_DB_FILE = BASE_DIR / "delta_sync_state.db"  # Delta SyncManager state (SQLite)
+LOG_FILE = BASE_DIR / "sync.log"
 
-# Create downloads directory if it doesn't exist
-os.makedirs(DOWNLOAD_PATH, exist_ok=True)
+def ensure_download_dir():
+    """Create downloads directory if it doesn't exist."""
+    os.makedirs(DOWNLOAD_PATH, exist_ok=True)
 
 # Microsoft Graph API settings
 GRAPH_BASE_URL = "https://graph.microsoft.com/v1.0"
@@ -24,10 +29,24 @@ GRAPH_BASE_URL = "https://graph.microsoft.com/v1.0"
 TENANT_ID = os.environ.get("SHAREPOINT_TENANT_ID", "your_tenant_id")
 CLIENT_ID = os.environ.get("SHAREPOINT_CLIENT_ID", "your_client_id")
 CLIENT_SECRET = os.environ.get("SHAREPOINT_CLIENT_SECRET", "your_client_secret")
-CLIENT_SECRET_ID = os.environ.get("SHAREPOINT_CLIENT_SECRET_ID", "your_client_secret_id")
 SITE_URL = os.environ.get("SHAREPOINT_SITE_URL", "your_sharepoint_site_url")
 
 # Sync settings
 SYNC_INTERVAL_MINUTES = 60  # How often to sync in minutes when running continuously
 FILE_TYPES_TO_EXCLUDE = []  # File extensions to exclude, e.g., ['.tmp', '.bak']
 PATHS_TO_EXCLUDE = []  # Paths to exclude, e.g., ['Shared Documents/Archive']
+STATE_SAVE_INTERVAL = 500  # Save the sync state after this many processed items during a sync
+MAX_DOWNLOAD_WORKERS = 8  # Number of files downloaded in parallel during a sync
+MAX_LIST_WORKERS = 16  # Number of folders listed in parallel when walking the drive
+
+# The exclusion rules, normalized once so each item needs a single C-level check
+EXCLUDE_EXTS = tuple(ext.lower() for ext in FILE_TYPES_TO_EXCLUDE)
+EXCLUDE_PATH_RE = (re.compile('|'.join(map(re.escape, PATHS_TO_EXCLUDE)))
+                   if PATHS_TO_EXCLUDE else None)
+
+# Change notifications for continuous sync (optional)
+# Set SHAREPOINT_NOTIFICATION_URL to a public HTTPS URL that forwards to NOTIFICATION_PORT
+# on this machine to sync as soon as something changes; otherwise continuous sync polls
+NOTIFICATION_URL = os.environ.get("SHAREPOINT_NOTIFICATION_URL", "")
+NOTIFICATION_PORT = int(os.environ.get("SHAREPOINT_NOTIFICATION_PORT", "8080"))
+SUBSCRIPTION_LIFETIME_HOURS = 24  # Subscriptions are renewed halfway through their lifetime
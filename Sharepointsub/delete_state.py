@@ -3,14 +3,14 @@ Script to delete the state file.
 """
 import os
 import sys
-from config import STATE_FILE
+from config import STATE_FILE, STATE_DB_FILE, DELTA_STATE_DB_FILE
 
 def main():
     """Delete the state file."""
-    print(f"Looking for state file at: {os.path.abspath(STATE_FILE)}")
+    print(f"Looking for state file at: {STATE_FILE}")
     
-    if os.path.exists(STATE_FILE):
-        print(f"State file found. Size: {os.path.getsize(STATE_FILE)} bytes")
+    if STATE_FILE.exists():
+        print(f"State file found. Size: {STATE_FILE.stat().st_size} bytes")
         
         try:
             os.remove(STATE_FILE)
@@ -43,6 +43,17 @@ def main():
         except Exception as e:
             print(f"Error deleting temporary state file: {str(e)}")
     
+    # Check for the state databases and their WAL files
+    for db_file in [f"{db}{suffix}" for db in (STATE_DB_FILE, DELTA_STATE_DB_FILE) for suffix in ("", "-wal", "-shm")]:
+        if os.path.exists(db_file):
+            print(f"State database file found at: {db_file}")
+
+            try:
+                os.remove(db_file)
+                print("State database file deleted successfully.")
+            except Exception as e:
+                print(f"Error deleting state database file: {str(e)}")
+    
     print("Done.")
     return 0
 
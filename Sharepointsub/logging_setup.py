@@ -0,0 +1,35 @@
+"""
+Logging setup shared by the sync tool's entry points.
+"""
+import os
+import sys
+import queue
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from config import LOG_FILE
+
+def setup_logging():
+    """
+    Log to LOG_FILE and stdout.
+    Records are formatted and written by a listener thread; the sync threads only
+    put them on a queue, so slow log storage never holds up a sync.
+    """
+    log_dir = os.path.dirname(LOG_FILE)
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir, exist_ok=True)
+
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handlers = [logging.FileHandler(LOG_FILE), logging.StreamHandler(sys.stdout)]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    log_queue = queue.Queue()
+    listener = QueueListener(log_queue, *handlers)
+    listener.start()
+    # Write out anything still queued on exit
+    atexit.register(listener.stop)
+
+    # Not basicConfig, which would give the queue handler a format of its own
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(QueueHandler(log_queue))
@@ -1,28 +1,12 @@
 """
 Main entry point for the Organizational SharePoint Sync Tool.
 """
-import os
 import sys
 import logging
 import argparse
 from datetime import datetime
 from .sync_manager import SyncManager
-from .config import LOG_FILE
-
-def setup_logging():
-    """Set up logging configuration."""
-    log_dir = os.path.dirname(LOG_FILE)
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir, exist_ok=True)
-    
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(LOG_FILE),
-            logging.StreamHandler(sys.stdout)
-        ]
-    )
+from .logging_setup import setup_logging
 
 def main():
     """Main function to run the sync tool."""
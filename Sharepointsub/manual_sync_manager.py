@@ -1,93 +1,204 @@
 """
-Manual sync manager for handling SharePoint synchronization without using delta API.
-This implementation uses a local state file to track file changes.
+Manual sync manager for handling SharePoint synchronization.
+This implementation uses a local SQLite state database to track file changes. The first sync
+walks the whole drive; later syncs only process the changes reported by the delta API.
 """
 import os
-import json
 import logging
 import time
+import shutil
+import sqlite3
+import threading
 import traceback
 from datetime import datetime
-from sharepoint_client import SharePointClient
-from config import STATE_FILE, FILE_TYPES_TO_EXCLUDE, PATHS_TO_EXCLUDE, SYNC_INTERVAL_MINUTES
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from json_utils import load_file, JSONDecodeError
+from sharepoint_client import SharePointClient, MAX_BATCH_REQUESTS
+from notifications import ChangeNotifier
+from config import (STATE_FILE, STATE_DB_FILE, EXCLUDE_EXTS, EXCLUDE_PATH_RE, SYNC_INTERVAL_MINUTES,
+                    MAX_LIST_WORKERS, MAX_DOWNLOAD_WORKERS, NOTIFICATION_URL)
+
+def _index_local_files(root):
+    """
+    Map every file under root to its size, keyed by its '/'-separated path relative to root
+    (the same form as the state's path keys). One directory walk replaces a stat per synced file.
+    """
+    index = {}
+    stack = [(root, "")]
+    while stack:
+        path, prefix = stack.pop()
+        try:
+            entries = os.scandir(path)
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, f"{prefix}{entry.name}/"))
+                else:
+                    index[f"{prefix}{entry.name}"] = entry.stat().st_size
+    return index
+
+def _make_download_check(file_state, local_index=None):
+    """
+    Build the check that decides whether a file needs downloading, once per sync.
+    The state lookups are bound as closure variables so the per-file check runs on locals
+    instead of repeated attribute lookups.
+
+    Returns:
+        function: (path_key, file_path, remote_mtime, remote_size) -> reason for downloading
+        the file, or None if the local copy is up to date
+    """
+    get_stored = file_state.get
+    if local_index is not None:
+        get_indexed = local_index.get
+
+        def local_size(path_key, file_path):
+            return get_indexed(path_key)
+    else:
+        def local_size(path_key, file_path):
+            try:
+                return os.stat(file_path).st_size
+            except FileNotFoundError:
+                return None
+
+    def needs_download(path_key, file_path, remote_mtime, remote_size):
+        stored = get_stored(path_key)
+        if stored is None:
+            return "New file found"
+        # If the remote file is newer or different size, download it
+        if remote_mtime and remote_mtime != stored.get('lastModifiedDateTime'):
+            return "File has been modified"
+        if remote_size != stored.get('size', 0):
+            return "File size has changed"
+        # Check the local copy of a file we think is unchanged
+        size = local_size(path_key, file_path)
+        if size is None:
+            return "Local file is missing"
+        if size != remote_size:
+            return "Local file size differs from remote"
+        return None
+
+    return needs_download
 
 class ManualSyncManager:
     """
     Manages the synchronization process between SharePoint and local files.
-    Uses a manual state tracking approach instead of delta sync API.
+    Uses a manual state tracking approach for the initial full sync and the delta API
+    for incremental syncs after that.
     """
-    def __init__(self, check_only=False):
+    def __init__(self, check_only=False, workers=MAX_DOWNLOAD_WORKERS):
         """
         Initialize the sync manager.
 
         Args:
             check_only (bool): If True, only check for changes without downloading
+            workers (int): Number of files to process (download) in parallel
         """
         self.client = SharePointClient()
-        self.state_file = STATE_FILE
+        self.state_file = STATE_DB_FILE
         self.file_state = {}
         self.last_sync = None
+        # Delta link from the last sync, and folder id -> relative path (delta items carry no path)
+        self.delta_link = None
+        self.folder_paths = {}
+        # Set when a full sync's walk couldn't list some folder, so its files are missing
+        self._listing_failed = False
+        # Set when a change couldn't be applied this sync; the delta link then stays where
+        # it was, so the next sync gets the same changes again
+        self._sync_failed = False
+        # Relative path -> size of the local files, built once per full sync
+        self._local_index = None
+        # Per-sync download check built by _make_download_check
+        self._needs_download = None
         self.check_only = check_only
+        self.workers = max(1, workers)
         self.files_processed = 0
-
-        logging.debug(f"ManualSyncManager initialized with options: check_only={check_only}")
+        # Per-sync outcome counts for the summary line (per-file messages are debug-level)
+        self.sync_counts = {'unchanged': 0, 'downloaded': 0, 'skipped': 0}
+        # Guards the state maps, the database connection and the counters, which
+        # list and download workers update concurrently
+        self._lock = threading.Lock()
+        self._db = None
+
+        logging.debug(f"ManualSyncManager initialized with options: check_only={check_only}, workers={self.workers}")
         self.load_state()
 
+    def _open_db(self):
+        """Open the state database, creating the tables if needed."""
+        # Autocommit mode; each sync runs in one explicit transaction committed by save_state
+        db = sqlite3.connect(self.state_file, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, id TEXT, mtime TEXT, size INTEGER)")
+        db.execute("CREATE TABLE IF NOT EXISTS folders (id TEXT PRIMARY KEY, path TEXT)")
+        db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        return db
+
+    def _import_json_state(self):
+        """
+        Copy the state from the old JSON state file into the (empty) database, so
+        existing installs don't start over with a full download.
+        """
+        if not os.path.exists(STATE_FILE):
+            return
+
+        try:
+            state = load_file(STATE_FILE)
+        except JSONDecodeError as e:
+            logging.error(f"Old state file contains invalid JSON, not importing it: {str(e)}")
+            return
+
+        # The delta SyncManager writes a different format to the same file
+        if "files" not in state:
+            return
+
+        logging.info(f"Importing sync state from old state file: {STATE_FILE}")
+        files = state.get("files", {})
+        self._db.execute("BEGIN")
+        self._db.executemany("INSERT OR REPLACE INTO files (path, id, mtime, size) VALUES (?, ?, ?, ?)",
+                             [(key, info.get('id'), info.get('lastModifiedDateTime'), info.get('size', 0))
+                              for key, info in files.items()])
+        self._db.executemany("INSERT OR REPLACE INTO folders (id, path) VALUES (?, ?)",
+                             state.get("folders", {}).items())
+        self._db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                             [("last_sync", state.get("last_sync")), ("delta_link", state.get("delta_link"))])
+        self._db.execute("COMMIT")
+
     def load_state(self):
         """Load previous sync state including file metadata."""
         try:
-            # Check if state file exists
-            if not os.path.exists(self.state_file):
-                logging.info(f"No state file found at: {os.path.abspath(self.state_file)}")
-                logging.info("Will perform full sync.")
-                return False
-
-            # Check if state file is empty
-            if os.path.getsize(self.state_file) == 0:
-                logging.warning(f"State file exists but is empty: {os.path.abspath(self.state_file)}")
-                logging.info("Will perform full sync.")
-                return False
+            is_new = not os.path.exists(self.state_file)
+            self._db = self._open_db()
+            if is_new:
+                self._import_json_state()
 
-            # Try to load the state file
-            try:
-                with open(self.state_file, 'r') as f:
-                    state = json.load(f)
-            except json.JSONDecodeError as e:
-                logging.error(f"State file contains invalid JSON: {str(e)}")
-
-                # Try to load backup if it exists
-                backup_file = f"{self.state_file}.bak"
-                if os.path.exists(backup_file):
-                    logging.info(f"Attempting to load backup state file: {backup_file}")
-                    try:
-                        with open(backup_file, 'r') as f:
-                            state = json.load(f)
-                        logging.info("Successfully loaded backup state file")
-                    except Exception as e2:
-                        logging.error(f"Failed to load backup state file: {str(e2)}")
-                        logging.info("Will perform full sync.")
-                        return False
-                else:
-                    logging.info("No backup state file found. Will perform full sync.")
-                    return False
+            for path_key, file_id, mtime, size in self._db.execute("SELECT path, id, mtime, size FROM files"):
+                self.file_state[path_key] = {
+                    'id': file_id,
+                    'name': path_key.rsplit('/', 1)[-1],
+                    'lastModifiedDateTime': mtime,
+                    'size': size,
+                    'path': path_key
+                }
+            self.folder_paths = dict(self._db.execute("SELECT id, path FROM folders"))
+            meta = dict(self._db.execute("SELECT key, value FROM meta"))
 
-            # Log the loaded state
-            logging.info(f"Loaded sync state from: {os.path.abspath(self.state_file)}")
-            
-            # Get file state from state
-            self.file_state = state.get("files", {})
-            
             # Get last sync time
-            self.last_sync = state.get("last_sync")
+            self.last_sync = meta.get("last_sync")
+
+            # Get delta tracking info
+            self.delta_link = meta.get("delta_link")
 
             # Log sync status
             if self.last_sync:
+                logging.info(f"Loaded sync state from: {self.state_file}")
                 logging.info(f"Last sync: {self.last_sync}")
                 logging.info(f"Found {len(self.file_state)} files in state")
-            else:
-                logging.info("No previous sync time found")
+                return True
 
-            return True
+            logging.info("No previous sync found. Will perform full sync.")
+            return False
 
         except Exception as e:
             logging.error(f"Error loading sync state: {str(e)}")
@@ -95,142 +206,194 @@ class ManualSyncManager:
             logging.info("Will perform full sync due to error.")
             return False
 
+    def _begin(self):
+        """Start the transaction that collects this sync's state changes."""
+        with self._lock:
+            # A sync that failed leaves its transaction open; its changes are committed with the next one
+            if self._db and not self._db.in_transaction:
+                self._db.execute("BEGIN")
+
+    def _set_file(self, path_key, info):
+        """Record a file in the state."""
+        with self._lock:
+            self.file_state[path_key] = info
+            if self._db:
+                self._db.execute("INSERT OR REPLACE INTO files (path, id, mtime, size) VALUES (?, ?, ?, ?)",
+                                 (path_key, info['id'], info['lastModifiedDateTime'], info['size']))
+
+    def _remove_files(self, prefix=None, path_key=None):
+        """Remove one file, or every file under a folder prefix, from the state."""
+        with self._lock:
+            if prefix is not None:
+                for key in [key for key in self.file_state if key.startswith(prefix)]:
+                    del self.file_state[key]
+                if self._db:
+                    self._db.execute("DELETE FROM files WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))
+            else:
+                self.file_state.pop(path_key, None)
+                if self._db:
+                    self._db.execute("DELETE FROM files WHERE path = ?", (path_key,))
+
+    def _set_folder(self, folder_id, folder_path):
+        """
+        Record a folder's relative path in the state. If the folder was known under another
+        path (it was moved or renamed), the folders and files below it are moved in the state
+        too. Returns the folder's previous path, or None if it wasn't known.
+        """
+        with self._lock:
+            old_path = self.folder_paths.get(folder_id)
+            self.folder_paths[folder_id] = folder_path
+            if self._db:
+                self._db.execute("INSERT OR REPLACE INTO folders (id, path) VALUES (?, ?)", (folder_id, folder_path))
+
+            if old_path and old_path != folder_path:
+                old_prefix, new_prefix = f"{old_path}/", f"{folder_path}/"
+                for other_id, path in self.folder_paths.items():
+                    if path.startswith(old_prefix):
+                        self.folder_paths[other_id] = new_prefix + path[len(old_prefix):]
+                for key in [key for key in self.file_state if key.startswith(old_prefix)]:
+                    info = self.file_state.pop(key)
+                    info['path'] = new_prefix + key[len(old_prefix):]
+                    self.file_state[info['path']] = info
+                if self._db:
+                    for table in ("folders", "files"):
+                        self._db.execute(f"UPDATE OR REPLACE {table} SET path = ? || substr(path, ?) "
+                                         f"WHERE substr(path, 1, ?) = ?",
+                                         (new_prefix, len(old_prefix) + 1, len(old_prefix), old_prefix))
+            return old_path
+
+    def _move_file(self, old_key, path_key):
+        """Record a file that was moved or renamed under its new path in the state."""
+        with self._lock:
+            info = self.file_state.get(old_key)
+        self._remove_files(path_key=old_key)
+        if info is not None:
+            self._set_file(path_key, dict(info, name=path_key.rsplit('/', 1)[-1], path=path_key))
+
+    def _move_local(self, old_path, new_path):
+        """
+        Move a local file or folder to where it now is on the server, so it isn't downloaded
+        again. If something is already at the new path, the old copy is just removed.
+        """
+        old_local = os.path.join(self.client.download_path, old_path)
+        new_local = os.path.join(self.client.download_path, new_path)
+        if not os.path.exists(old_local):
+            return
+        if os.path.exists(new_local):
+            if os.path.isdir(old_local):
+                shutil.rmtree(old_local)
+            else:
+                os.remove(old_local)
+            logging.info(f"Removed old copy: {old_local}")
+        else:
+            os.makedirs(os.path.dirname(new_local), exist_ok=True)
+            os.replace(old_local, new_local)
+            logging.info(f"Moved: {old_local} -> {new_local}")
+
+    def _remove_folder(self, folder_id):
+        """Remove a folder from the state and return its relative path."""
+        with self._lock:
+            folder_path = self.folder_paths.pop(folder_id)
+            if self._db:
+                self._db.execute("DELETE FROM folders WHERE id = ?", (folder_id,))
+            return folder_path
+
     def save_state(self):
-        """Save current sync state."""
+        """
+        Save current sync state.
+        Files and folders are written to the database as they change, so this only
+        records the sync time and delta link and commits the sync's transaction.
+        """
         try:
-            # Log the state file path
-            logging.info(f"Attempting to save sync state to: {os.path.abspath(self.state_file)}")
-
-            # Create state object
-            state = {
-                "files": self.file_state,
-                "last_sync": datetime.now().isoformat(),
-                "version": "1.0"  # Add version for future compatibility
-            }
-
-            # Ensure directory exists
-            state_dir = os.path.dirname(self.state_file)
-            if state_dir and not os.path.exists(state_dir):
-                logging.info(f"Creating directory for state file: {state_dir}")
-                os.makedirs(state_dir, exist_ok=True)
-
-            # First write to a temporary file, then rename to avoid corruption
-            temp_file = f"{self.state_file}.tmp"
-            logging.debug(f"Writing state to temporary file: {temp_file}")
-
-            with open(temp_file, 'w') as f:
-                json.dump(state, f, indent=2)  # Use indentation for readability
-
-            # Verify the temp file was created
-            if not os.path.exists(temp_file):
-                logging.error(f"Failed to create temporary state file at: {temp_file}")
-                return
+            with self._lock:
+                self._db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                     [("last_sync", datetime.now().isoformat()), ("delta_link", self.delta_link)])
+                if self._db.in_transaction:
+                    self._db.execute("COMMIT")
 
-            # Rename the temp file to the actual state file
-            if os.path.exists(self.state_file):
-                # Create a backup of the existing state file
-                backup_file = f"{self.state_file}.bak"
-                try:
-                    os.replace(self.state_file, backup_file)
-                    logging.debug(f"Created backup of existing state file: {backup_file}")
-                except Exception as e:
-                    logging.warning(f"Could not create backup of state file: {str(e)}")
-
-            # Now rename the temp file to the actual state file
-            os.replace(temp_file, self.state_file)
-
-            # Verify the file was created
-            if os.path.exists(self.state_file):
-                file_size = os.path.getsize(self.state_file)
-                logging.info(f"Successfully saved sync state. File size: {file_size} bytes")
-
-                # Read back the file to verify it's valid JSON
-                try:
-                    with open(self.state_file, 'r') as f:
-                        json.load(f)
-                    logging.debug("Verified state file contains valid JSON")
-                except json.JSONDecodeError:
-                    logging.error("State file contains invalid JSON!")
-            else:
-                logging.error(f"Failed to create state file at: {self.state_file}")
+            logging.info(f"Saved sync state to: {self.state_file}")
 
         except Exception as e:
             logging.error(f"Error saving sync state: {str(e)}")
             logging.debug(f"Stack trace: {traceback.format_exc()}")
 
-            # Try one more time with a simpler approach
-            try:
-                logging.info("Trying fallback method to save state...")
-                with open(self.state_file, 'w') as f:
-                    json.dump({"files": self.file_state, "last_sync": datetime.now().isoformat()}, f)
-                logging.info("Fallback save succeeded")
-            except Exception as e2:
-                logging.error(f"Fallback save also failed: {str(e2)}")
-
-    def should_process_item(self, item):
+    def should_process_item(self, item, parent_path=None):
         """
         Determine if an item should be processed based on exclusion rules.
         """
         # Check file extension exclusions
         name = item.get('name', '')
-        if any(name.lower().endswith(ext.lower()) for ext in FILE_TYPES_TO_EXCLUDE):
-            logging.info(f"Skipping excluded file type: {name}")
+        if EXCLUDE_EXTS and name.lower().endswith(EXCLUDE_EXTS):
+            logging.debug("Skipping excluded file type: %s", name)
             return False
 
-        # Check path exclusions
-        parent_path = self.client._get_parent_path(item)
-        full_path = os.path.join(parent_path, name)
-        if any(excl_path in full_path for excl_path in PATHS_TO_EXCLUDE):
-            logging.info(f"Skipping excluded path: {full_path}")
-            return False
+        # Check path exclusions (the parent path is only needed when there are any)
+        if EXCLUDE_PATH_RE:
+            if parent_path is None:
+                parent_path = self.client._get_parent_path(item)
+            full_path = f"{parent_path}/{name}" if parent_path else name
+            if EXCLUDE_PATH_RE.search(full_path):
+                logging.debug("Skipping excluded path: %s", full_path)
+                return False
 
         return True
 
-    def process_item(self, item):
+    def process_item(self, item, parent_path=None):
         """
         Process an item (file or folder).
         """
         try:
+            name = item.get('name', '')
+            if parent_path is None:
+                parent_path = self.client._get_parent_path(item)
+
             # Skip items that match exclusion rules
-            if not self.should_process_item(item):
+            if not self.should_process_item(item, parent_path):
+                self._count('skipped')
                 return
 
-            name = item.get('name', '')
-            parent_path = self.client._get_parent_path(item)
-            full_path = os.path.join(parent_path, name) if parent_path else name
-
             # Handle folder
             if 'folder' in item:
-                self.handle_folder(item)
+                self.handle_folder(item, parent_path)
             # Handle file
             elif 'file' in item:
-                self.handle_file(item)
-                self.files_processed += 1
+                self.handle_file(item, parent_path)
+                with self._lock:
+                    self.files_processed += 1
             else:
                 logging.warning(f"Unknown item type: {name}")
 
         except Exception as e:
+            self._sync_failed = True
             logging.error(f"Error processing item {item.get('name', 'unknown')}: {str(e)}")
             logging.debug(f"Stack trace: {traceback.format_exc()}")
 
-    def handle_folder(self, item):
+    def _count(self, outcome):
+        """Count a file outcome for the sync summary."""
+        with self._lock:
+            self.sync_counts[outcome] += 1
+
+    def handle_folder(self, item, parent_path=None):
         """
         Handle a folder item - create the folder locally if it doesn't exist.
         """
         try:
             name = item.get('name', '')
-            parent_path = self.client._get_parent_path(item)
+            if parent_path is None:
+                parent_path = self.client._get_parent_path(item)
             folder_path = os.path.join(self.client.download_path, parent_path, name)
 
-            if not os.path.exists(folder_path):
-                os.makedirs(folder_path, exist_ok=True)
+            try:
+                os.makedirs(folder_path)
                 logging.info(f"Created folder: {folder_path}")
+            except FileExistsError:
+                pass
 
         except Exception as e:
             logging.error(f"Error handling folder {item.get('name', 'unknown')}: {str(e)}")
             logging.debug(f"Stack trace: {traceback.format_exc()}")
 
-    def handle_file(self, item):
+    def handle_file(self, item, parent_path=None):
         """
         Handle a file item - download the file if it's new or modified.
         """
@@ -238,83 +401,101 @@ class ManualSyncManager:
             # Get file metadata
             file_id = item.get('id')
             name = item.get('name', '')
-            parent_path = self.client._get_parent_path(item)
+            if parent_path is None:
+                parent_path = self.client._get_parent_path(item)
             file_path = os.path.join(self.client.download_path, parent_path, name)
             remote_mtime_str = item.get('lastModifiedDateTime')
             size_bytes = item.get('size', 0)
             
-            # Format size for display
-            size_mb = size_bytes / (1024 * 1024)
-            size_display = f"{size_mb:.2f} MB" if size_bytes > 0 else "unknown size"
-            
             # Create a unique path key for the state file
             path_key = os.path.join(parent_path, name).replace('\\', '/')
-            
+
             # Check if we need to download this file
-            need_download = False
-            
-            # If the file is in our state
-            if path_key in self.file_state:
-                stored_info = self.file_state[path_key]
-                stored_mtime = stored_info.get('lastModifiedDateTime')
-                stored_size = stored_info.get('size', 0)
-                
-                # If the remote file is newer or different size, download it
-                if remote_mtime_str and remote_mtime_str != stored_mtime:
-                    logging.info(f"File has been modified: {name}")
-                    need_download = True
-                elif size_bytes != stored_size:
-                    logging.info(f"File size has changed: {name}")
-                    need_download = True
-                else:
-                    logging.info(f"File is unchanged: {name}")
-            else:
-                # File is not in our state, so it's new
-                logging.info(f"New file found: {name}")
-                need_download = True
-            
-            # Check if the local file exists and matches what we expect
-            if os.path.exists(file_path) and not need_download:
-                local_size = os.path.getsize(file_path)
-                if local_size != size_bytes:
-                    logging.info(f"Local file size ({local_size}) differs from remote ({size_bytes}): {name}")
-                    need_download = True
-            
-            # If the local file doesn't exist, we need to download
-            if not os.path.exists(file_path):
-                need_download = True
-            
+            needs_download = self._needs_download or _make_download_check(self.file_state, self._local_index)
+            reason = needs_download(path_key, file_path, remote_mtime_str, size_bytes)
+            if reason is None:
+                logging.debug("Skipping file (up-to-date): %s", name)
+                self._count('unchanged')
+                return
+            logging.info("%s: %s", reason, name)
+
+            # Format size for display
+            size_mb = size_bytes / (1024 * 1024)
+            size_display = f"{size_mb:.2f} MB" if size_bytes > 0 else "unknown size"
+
             # In check-only mode, just log what would be downloaded
             if self.check_only:
-                if need_download:
-                    logging.info(f"Would download: {name} ({size_display})")
+                logging.info("Would download: %s (%s)", name, size_display)
                 return
-            
-            # Download the file if needed
-            if need_download:
-                logging.info(f"Downloading file: {name} ({size_display})")
-                
-                # Download the file
-                self.client.download_file(item)
-                
-                # Update the state with the new file info
-                self.file_state[path_key] = {
-                    'id': file_id,
-                    'name': name,
-                    'lastModifiedDateTime': remote_mtime_str,
-                    'size': size_bytes,
-                    'path': path_key
-                }
-            else:
-                logging.info(f"Skipping file (up-to-date): {name}")
+
+            # Download the file
+            logging.info(f"Downloading file: {name} ({size_display})")
+            self.client.download_file(item, parent_path)
+
+            # Update the state with the new file info
+            self._set_file(path_key, {
+                'id': file_id,
+                'name': name,
+                'lastModifiedDateTime': remote_mtime_str,
+                'size': size_bytes,
+                'path': path_key
+            })
+            self._count('downloaded')
 
         except Exception as e:
+            self._sync_failed = True
             logging.error(f"Error handling file {item.get('name', 'unknown')}: {str(e)}")
             logging.debug(f"Stack trace: {traceback.format_exc()}")
 
+    def _list_folders(self, folders):
+        """
+        List a group of folders with one batched request and split their children into
+        files and subfolders.
+
+        Args:
+            folders (list): (children endpoint, folder path) tuples
+
+        Returns:
+            tuple: (list of file items, list of (folder_id, folder_path) tuples)
+        """
+        files, subfolders = [], []
+        try:
+            listings = self.client.get_children_batch([endpoint for endpoint, _ in folders])
+            for (_, path), items in zip(folders, listings):
+                if items is None:
+                    # Already logged by the client; only this folder is lost
+                    self._listing_failed = True
+                    continue
+                for item in items:
+                    # Remember the drive root's real ID so delta items in the root resolve to ""
+                    if not path:
+                        self._set_folder(item.get('parentReference', {}).get('id'), "")
+
+                    if 'file' in item:
+                        files.append(item)
+                    elif 'folder' in item:
+                        folder_path = f"{path}/{item.get('name', '')}" if path else item.get('name', '')
+                        # Keep the path even for excluded folders so delta items below them resolve
+                        # correctly (and are excluded again in process_item)
+                        self._set_folder(item.get('id'), folder_path)
+                        # Exclusions match path substrings, so everything below an excluded folder is
+                        # excluded too; don't spend requests listing it
+                        if EXCLUDE_PATH_RE and EXCLUDE_PATH_RE.search(folder_path):
+                            logging.info(f"Skipping excluded path: {folder_path}")
+                            continue
+                        subfolders.append((item.get('id'), folder_path))
+        except Exception as e:
+            self._listing_failed = True
+            paths = ', '.join(path or 'root' for _, path in folders)
+            logging.error(f"Error getting files from {paths}: {str(e)}")
+            logging.debug(f"Stack trace: {traceback.format_exc()}")
+        return files, subfolders
+
     def get_all_files_recursive(self, folder_id="root", path=""):
         """
         Get all files recursively from SharePoint.
+        Queued folders are listed in groups of up to 20 per Graph $batch request, and the
+        groups are fetched in parallel.
         
         Args:
             folder_id (str): The folder ID to start from
@@ -324,49 +505,146 @@ class ManualSyncManager:
             list: List of file items
         """
         all_items = []
+        self._listing_failed = False
         try:
-            # Get items in the current folder
+            # Resolve the site and drive once, before the workers need them
             drive_id = self.client.get_drive_id()
             site_id = self.client.get_site_id()
-            
-            if folder_id == "root":
-                endpoint = f"sites/{site_id}/drives/{drive_id}/root/children"
-            else:
-                endpoint = f"sites/{site_id}/drives/{drive_id}/items/{folder_id}/children"
-                
-            response = self.client._make_request(endpoint)
-            items = response.get('value', [])
-            
-            # Process each item
-            for item in items:
-                # If it's a file, add it to our list
-                if 'file' in item:
-                    all_items.append(item)
-                
-                # If it's a folder, process it recursively
-                elif 'folder' in item:
-                    folder_id = item.get('id')
-                    folder_name = item.get('name', '')
-                    new_path = os.path.join(path, folder_name)
-                    
-                    # Get items in this folder
-                    folder_items = self.get_all_files_recursive(folder_id, new_path)
-                    all_items.extend(folder_items)
-            
+            drive_endpoint = f"sites/{site_id}/drives/{drive_id}"
+
+            def children_endpoint(folder_id):
+                if folder_id == "root":
+                    return f"{drive_endpoint}/root/children"
+                return f"{drive_endpoint}/items/{folder_id}/children"
+
+            to_list = [(children_endpoint(folder_id), path)]
+            with ThreadPoolExecutor(max_workers=MAX_LIST_WORKERS) as executor:
+                pending = set()
+                while to_list or pending:
+                    # Hand out the queued folders in groups that fit in one $batch request
+                    while to_list:
+                        pending.add(executor.submit(self._list_folders, to_list[:MAX_BATCH_REQUESTS]))
+                        del to_list[:MAX_BATCH_REQUESTS]
+
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        files, folders = future.result()
+                        all_items.extend(files)
+                        to_list.extend((children_endpoint(child_id), child_path) for child_id, child_path in folders)
+
             return all_items
             
         except Exception as e:
+            self._listing_failed = True
             logging.error(f"Error getting files from {path or 'root'}: {str(e)}")
             logging.debug(f"Stack trace: {traceback.format_exc()}")
             return all_items
 
+    def _resolve_parent_path(self, item):
+        """
+        Get an item's parent path from the folder map, falling back to its parentReference path.
+        """
+        parent_id = item.get('parentReference', {}).get('id')
+        if parent_id in self.folder_paths:
+            return self.folder_paths[parent_id]
+        return self.client._get_parent_path(item)
+
+    def handle_deletion(self, item, ids_to_keys):
+        """
+        Remove a file or folder that was deleted in SharePoint.
+        """
+        try:
+            item_id = item.get('id')
+            if self.check_only:
+                logging.info(f"Would delete: {self.folder_paths.get(item_id) or ids_to_keys.get(item_id) or item_id}")
+                return
+
+            if item_id in self.folder_paths:
+                folder_path = self._remove_folder(item_id)
+                local_path = os.path.join(self.client.download_path, folder_path)
+                self._remove_files(prefix=f"{folder_path}/")
+                if os.path.isdir(local_path):
+                    shutil.rmtree(local_path)
+                    logging.info(f"Deleted folder: {local_path}")
+            elif item_id in ids_to_keys:
+                path_key = ids_to_keys[item_id]
+                self._remove_files(path_key=path_key)
+                local_path = os.path.join(self.client.download_path, path_key)
+                if os.path.exists(local_path):
+                    os.remove(local_path)
+                    logging.info(f"Deleted file: {local_path}")
+
+        except Exception as e:
+            self._sync_failed = True
+            logging.error(f"Error handling deletion of {item.get('id', 'unknown')}: {str(e)}")
+            logging.debug(f"Stack trace: {traceback.format_exc()}")
+
+    def _get_delta_items(self):
+        """
+        Get the files changed since the last sync from the delta API.
+        Deletions and folder changes are applied here. Returns the changed files as
+        (item, parent_path) pairs, and the delta link to use once they are all handled.
+        """
+        delta_response = self.client.get_delta(self.delta_link)
+        items = delta_response.get('value', [])
+        logging.info(f"Delta query returned {len(items)} changed items")
+
+        ids_to_keys = {info.get('id'): key for key, info in self.file_state.items()}
+        files = []
+        for item in items:
+            if 'deleted' in item:
+                self.handle_deletion(item, ids_to_keys)
+            elif 'root' in item:
+                self._set_folder(item.get('id'), "")
+            elif 'folder' in item:
+                parent_path = self._resolve_parent_path(item)
+                name = item.get('name', '')
+                folder_path = f"{parent_path}/{name}" if parent_path else name
+                old_path = self.folder_paths.get(item.get('id'))
+                if old_path and old_path != folder_path:
+                    # Moved or renamed: move the local copy along with its state
+                    if self.check_only:
+                        logging.info(f"Would move: {old_path} -> {folder_path}")
+                        continue
+                    self._set_folder(item.get('id'), folder_path)
+                    self._move_local(old_path, folder_path)
+                    ids_to_keys = {info.get('id'): key for key, info in self.file_state.items()}
+                else:
+                    self._set_folder(item.get('id'), folder_path)
+            elif 'file' in item:
+                parent_path = self._resolve_parent_path(item)
+                name = item.get('name', '')
+                path_key = f"{parent_path}/{name}" if parent_path else name
+                old_key = ids_to_keys.get(item.get('id'))
+                if old_key is not None and old_key != path_key:
+                    # Moved or renamed: the local copy goes with it, and is only downloaded
+                    # again if its content changed too
+                    if self.check_only:
+                        logging.info(f"Would move: {old_key} -> {path_key}")
+                    else:
+                        self._move_file(old_key, path_key)
+                        self._move_local(old_key, path_key)
+                        ids_to_keys[item.get('id')] = path_key
+                files.append((item, parent_path))
+
+        return files, delta_response.get('@odata.deltaLink', self.delta_link)
+
     def perform_sync(self):
         """
-        Perform a sync with SharePoint using manual state tracking.
+        Perform a sync with SharePoint.
+        Uses the delta API when a delta link from a previous sync is available,
+        otherwise walks the whole drive.
         """
         try:
-            # Reset counters
+            # Reset counters (and any local index left by a failed sync)
             self.files_processed = 0
+            self.sync_counts = dict.fromkeys(self.sync_counts, 0)
+            self._local_index = None
+            self._needs_download = None
+            self._sync_failed = False
+
+            # Collect this sync's state changes in one transaction, committed by save_state
+            self._begin()
 
             # Log sync mode
             if self.check_only:
@@ -374,18 +652,45 @@ class ManualSyncManager:
             else:
                 logging.info("Starting sync process...")
 
-            # Get all files recursively
-            items = self.get_all_files_recursive()
+            if self.delta_link:
+                # Incremental sync: only the changes since the last sync
+                logging.info("Using delta link from the last sync")
+                changed, new_delta_link = self._get_delta_items()
+                items = [item for item, _ in changed]
+                parent_paths = [parent_path for _, parent_path in changed]
+            else:
+                # Full sync: take a delta link first so changes made during the walk are picked up next time
+                logging.info("No delta link found. Performing full sync.")
+                new_delta_link = self.client.get_latest_delta_link()
+                items = self.get_all_files_recursive()
+                # Check local copies against one scan of the download folder
+                self._local_index = _index_local_files(self.client.download_path)
+                parent_paths = [None] * len(items)
+                if self._listing_failed:
+                    # Starting from this delta link would never fetch the files that were missed
+                    logging.warning("Some folders could not be listed; the next sync will be a full sync again")
+                    new_delta_link = None
             
+            self._needs_download = _make_download_check(self.file_state, self._local_index)
+
             # Log what we found
             total_items = len(items)
             logging.info(f"Found {total_items} files to process")
             
-            # Process each item
-            for i, item in enumerate(items):
-                if i % 10 == 0:  # Log progress every 10 items
-                    logging.info(f"Processing item {i+1}/{total_items}...")
-                self.process_item(item)
+            # Process items in parallel (downloads are network-bound), logging progress every 10 items
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for done, _ in enumerate(executor.map(self.process_item, items, parent_paths)):
+                    if done % 10 == 0:
+                        logging.info(f"Processing item {done+1}/{total_items}...")
+            self._local_index = None
+            self._needs_download = None
+
+            # Move the delta link on only when every change was applied; in check-only mode
+            # nothing is applied, so the same changes must be seen again next time
+            if self._sync_failed:
+                logging.warning("Some changes could not be applied; they will be retried in the next sync")
+            elif new_delta_link and not self.check_only:
+                self.delta_link = new_delta_link
             
             # Save the state file
             self.save_state()
@@ -395,7 +700,11 @@ class ManualSyncManager:
                 logging.info(f"Sync completed successfully in CHECK-ONLY mode")
             else:
                 logging.info("Sync completed successfully")
-                logging.info(f"Downloaded {self.files_processed} files")
+            # processed counts every item walked (as in the OneDrive tool); skipped ones are
+            # also counted under skipped
+            logging.info("Sync summary: processed=%s unchanged=%s downloaded=%s skipped=%s",
+                         total_items, self.sync_counts['unchanged'],
+                         self.sync_counts['downloaded'], self.sync_counts['skipped'])
 
             return True
 
@@ -406,27 +715,42 @@ class ManualSyncManager:
 
     def run_continuous_sync(self):
         """
-        Run the sync process continuously at specified intervals.
+        Run the sync process continuously.
+        With change notifications configured, each sync runs as soon as a change is notified
+        (or after the sync interval at the latest); otherwise it runs at the sync interval.
         """
+        notifier = None
         try:
             logging.info(f"Starting continuous sync (interval: {SYNC_INTERVAL_MINUTES} minutes)")
 
+            if NOTIFICATION_URL:
+                notifier = ChangeNotifier(self.client)
+                if not notifier.start():
+                    logging.warning(f"Falling back to syncing every {SYNC_INTERVAL_MINUTES} minutes")
+                    notifier = None
+
             while True:
                 success = self.perform_sync()
 
-                if success:
-                    logging.info(f"Waiting {SYNC_INTERVAL_MINUTES} minutes until next sync...")
-                else:
+                if not success:
                     logging.warning(f"Sync failed. Will retry in {SYNC_INTERVAL_MINUTES} minutes...")
-
-                # Sleep until next sync
-                time.sleep(SYNC_INTERVAL_MINUTES * 60)
+                    time.sleep(SYNC_INTERVAL_MINUTES * 60)
+                elif notifier:
+                    logging.info(f"Waiting for changes (at most {SYNC_INTERVAL_MINUTES} minutes)...")
+                    notifier.wait(SYNC_INTERVAL_MINUTES * 60)
+                else:
+                    logging.info(f"Waiting {SYNC_INTERVAL_MINUTES} minutes until next sync...")
+                    # Sleep until next sync
+                    time.sleep(SYNC_INTERVAL_MINUTES * 60)
 
         except KeyboardInterrupt:
             logging.info("Sync process interrupted by user")
         except Exception as e:
             logging.error(f"Unexpected error in continuous sync: {str(e)}")
             logging.debug(f"Stack trace: {traceback.format_exc()}")
+        finally:
+            if notifier:
+                notifier.stop()
 
     def run_one_time_sync(self):
         """
@@ -0,0 +1,144 @@
+"""
+Change notifications for continuous sync.
+Subscribes to Microsoft Graph change notifications for the drive and receives them on a
+small local HTTP server, so continuous sync can run as soon as something changes instead
+of only on a fixed interval.
+"""
+import hmac
+import logging
+import secrets
+import threading
+import traceback
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from json_utils import loads
+from config import NOTIFICATION_URL, NOTIFICATION_PORT, SUBSCRIPTION_LIFETIME_HOURS
+
+class ChangeNotifier:
+    """
+    Keeps a Graph subscription on the drive alive and signals when a notification arrives.
+    NOTIFICATION_URL must be a public HTTPS URL that forwards to NOTIFICATION_PORT on this machine.
+    """
+    def __init__(self, client, notification_url=NOTIFICATION_URL, port=NOTIFICATION_PORT):
+        """
+        Initialize the notifier.
+
+        Args:
+            client (SharePointClient): Client used to manage the subscription
+            notification_url (str): Public URL Graph sends notifications to
+            port (int): Local port the notification server listens on
+        """
+        self.client = client
+        self.notification_url = notification_url
+        self.port = port
+        self.subscription_id = None
+        self.changed = threading.Event()
+        # Graph sends this back with every notification, so forged requests can be ignored
+        self._client_state = secrets.token_urlsafe(32)
+        self._stop = threading.Event()
+        self._server = None
+
+    @staticmethod
+    def _expiration():
+        """Get the expiration time for a new or renewed subscription."""
+        expires = datetime.now(timezone.utc) + timedelta(hours=SUBSCRIPTION_LIFETIME_HOURS)
+        return expires.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    def start(self):
+        """
+        Start the notification server and create the subscription.
+        Returns True if notifications are set up, False if the caller should fall back to polling.
+        """
+        try:
+            self._server = ThreadingHTTPServer(("", self.port), self._make_handler())
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+            # Graph validates the notification URL before it creates the subscription,
+            # so the server has to be running first
+            subscription = self.client.create_subscription(self.notification_url, self._expiration(),
+                                                           self._client_state)
+            self.subscription_id = subscription.get('id')
+            logging.info(f"Subscribed to change notifications (subscription {self.subscription_id})")
+
+            threading.Thread(target=self._renew_loop, daemon=True).start()
+            return True
+
+        except Exception as e:
+            logging.warning(f"Could not set up change notifications: {str(e)}")
+            logging.debug(f"Stack trace: {traceback.format_exc()}")
+            self.stop()
+            return False
+
+    def wait(self, timeout):
+        """
+        Wait until a change notification arrives or the timeout passes.
+        Returns True if a change was notified.
+        """
+        notified = self.changed.wait(timeout)
+        self.changed.clear()
+        return notified
+
+    def stop(self):
+        """Delete the subscription and stop the notification server."""
+        self._stop.set()
+        if self.subscription_id:
+            try:
+                self.client.delete_subscription(self.subscription_id)
+                logging.info(f"Deleted change notification subscription {self.subscription_id}")
+            except Exception as e:
+                logging.warning(f"Could not delete subscription {self.subscription_id}: {str(e)}")
+            self.subscription_id = None
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _renew_loop(self):
+        """Extend the subscription halfway through each lifetime until stopped."""
+        while not self._stop.wait(SUBSCRIPTION_LIFETIME_HOURS * 3600 / 2):
+            try:
+                self.client.renew_subscription(self.subscription_id, self._expiration())
+                logging.info("Renewed change notification subscription")
+            except Exception as e:
+                # The sync interval still applies as a timeout, so syncs continue without notifications
+                logging.error(f"Error renewing change notification subscription: {str(e)}")
+
+    def _make_handler(self):
+        """Build the request handler class for the notification server."""
+        notifier = self
+
+        class NotificationHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                # Validation request: echo the token back as plain text
+                token = parse_qs(urlparse(self.path).query).get('validationToken')
+                if token:
+                    body = token[0].encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+
+                length = int(self.headers.get('Content-Length', 0))
+                try:
+                    notifications = loads(self.rfile.read(length)).get('value', [])
+                except Exception:
+                    notifications = []
+
+                # Acknowledge right away; the sync itself runs on the main thread
+                self.send_response(202)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+                if any(hmac.compare_digest(str(n.get('clientState', '')), notifier._client_state)
+                       for n in notifications):
+                    logging.info("Change notification received")
+                    notifier.changed.set()
+
+            def log_message(self, format, *args):
+                # Keep the server's access log out of the sync log unless debugging
+                logging.debug(format, *args)
+
+        return NotificationHandler
@@ -24,28 +24,15 @@ else:
 
 # Import the sync manager
 from manual_sync_manager import ManualSyncManager
-from config import LOG_FILE
-
-def setup_logging():
-    """Set up logging configuration."""
-    log_dir = os.path.dirname(LOG_FILE)
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir, exist_ok=True)
-
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(LOG_FILE),
-            logging.StreamHandler(sys.stdout)
-        ]
-    )
+from config import MAX_DOWNLOAD_WORKERS
+from logging_setup import setup_logging
 
 def main():
     """Main function to run the sync tool."""
     parser = argparse.ArgumentParser(description='Organizational SharePoint Sync Tool')
     parser.add_argument('--continuous', action='store_true', help='Run in continuous mode')
     parser.add_argument('--check-only', action='store_true', help='Check for changes but don\'t download')
+    parser.add_argument('--workers', type=int, default=MAX_DOWNLOAD_WORKERS, help='Number of files to download in parallel')
     args = parser.parse_args()
 
     setup_logging()
@@ -55,7 +42,7 @@ def main():
     logging.info("=" * 80)
 
     try:
-        sync_manager = ManualSyncManager(check_only=args.check_only)
+        sync_manager = ManualSyncManager(check_only=args.check_only, workers=args.workers)
 
         if args.continuous:
             sync_manager.run_continuous_sync()
@@ -2,12 +2,61 @@
 SharePoint client for interacting with Microsoft Graph API.
 """
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
-import json
+import shutil
 import logging
 from urllib.parse import urlparse
+from json_utils import loads
 from auth import SharePointAuth
-from config import GRAPH_BASE_URL, SITE_URL, DOWNLOAD_PATH
+from config import GRAPH_BASE_URL, SITE_URL, DOWNLOAD_PATH, ensure_download_dir
+
+# Graph accepts at most 20 requests in one $batch call
+MAX_BATCH_REQUESTS = 20
+
+# Delta queries only return the fields the sync managers read, in large pages.
+# Delta links returned by Graph keep these parameters for later rounds.
+DELTA_PARAMS = {
+    '$select': 'id,name,size,file,folder,root,deleted,eTag,cTag,lastModifiedDateTime,'
+               'parentReference,@microsoft.graph.downloadUrl',
+    '$top': 500
+}
+
+def _part_offset(part_path, tag_path, remote_size, remote_tag):
+    """
+    Get the size of a .part file left by an earlier download, to resume from, or 0.
+    The .tag file next to it holds the eTag of the version being downloaded; a .part
+    file of another (or an unknown) version is deleted instead of resumed.
+    """
+    if not os.path.exists(part_path):
+        return 0
+    try:
+        with open(tag_path) as f:
+            part_tag = f.read()
+    except FileNotFoundError:
+        part_tag = None
+    offset = os.path.getsize(part_path)
+    if remote_tag and part_tag == remote_tag and remote_size and offset < remote_size:
+        return offset
+    _remove_files(part_path, tag_path)
+    return 0
+
+def _write_part_tag(tag_path, tag):
+    """Record which version of a file its .part file holds."""
+    if tag:
+        with open(tag_path, 'w') as f:
+            f.write(tag)
+    else:
+        _remove_files(tag_path)
+
+def _remove_files(*paths):
+    """Delete files, ignoring ones that don't exist."""
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
 
 class SharePointClient:
     """
@@ -20,16 +69,24 @@ class SharePointClient:
         self.base_url = GRAPH_BASE_URL
         self.site_url = SITE_URL
         self.download_path = DOWNLOAD_PATH
+        ensure_download_dir()
         self.site_id = None
         self.drive_id = None
 
+        # One pooled keep-alive session shared by the listing and download threads,
+        # retrying throttled (429) and transient server errors with backoff
+        self.session = requests.Session()
+        retries = Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                        respect_retry_after_header=True)
+        self.session.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=retries))
+
     def _make_request(self, endpoint, method="GET", params=None, data=None, stream=False):
         """Make a request to the Microsoft Graph API."""
         url = f"{self.base_url}/{endpoint}"
         headers = self.auth.get_headers()
 
         try:
-            response = requests.request(
+            response = self.session.request(
                 method=method,
                 url=url,
                 headers=headers,
@@ -40,10 +97,9 @@ class SharePointClient:
 
             # Handle token expiration
             if response.status_code == 401:
-                # Token expired, get a new one
-                self.auth.access_token = None
-                headers = self.auth.get_headers()
-                response = requests.request(
+                # Token expired or was revoked; get a new one rather than the cached one
+                headers = self.auth.get_headers(force_refresh=True)
+                response = self.session.request(
                     method=method,
                     url=url,
                     headers=headers,
@@ -56,7 +112,8 @@ class SharePointClient:
             response.raise_for_status()
 
             if method == "GET" and not stream and response.content:
-                return response.json()
+                # Parse the raw bytes with the fast JSON backend (delta pages can be several MB)
+                return loads(response.content)
             return response
 
         except requests.exceptions.RequestException as e:
@@ -127,29 +184,155 @@ class SharePointClient:
             logging.error(f"Error getting drive ID: {str(e)}")
             raise
 
-    def get_delta(self, delta_link=None):
+    def _paginate(self, endpoint, params=None):
         """
-        Get changes since the last sync using delta query.
+        Yield each page of a collection request, following @odata.nextLink until the last page.
+        """
+        while endpoint:
+            page = self._make_request(endpoint, params=params)
+            yield page
+
+            # nextLink is an absolute URL that already carries the query parameters
+            next_link = page.get('@odata.nextLink')
+            endpoint = next_link.replace(self.base_url + '/', '') if next_link else None
+            params = None
+
+    def get_children(self, endpoint):
+        """
+        Get all children of a folder across every page of results.
+        """
+        items = []
+        for page in self._paginate(endpoint, params={'$top': 999}):
+            items.extend(page.get('value', []))
+        return items
+
+    def batch(self, endpoints):
+        """
+        Send GET requests for up to MAX_BATCH_REQUESTS endpoints in a single $batch call.
+        Returns the sub-responses (with 'status' and 'body') in the same order as endpoints.
+        """
+        body = {"requests": [{"id": str(i), "method": "GET", "url": f"/{endpoint}"}
+                             for i, endpoint in enumerate(endpoints)]}
+        response = self._make_request("$batch", method="POST", data=body)
+        responses = {r.get('id'): r for r in loads(response.content).get('responses', [])}
+        return [responses.get(str(i), {}) for i in range(len(endpoints))]
+
+    def get_children_batch(self, endpoints):
+        """
+        Get all children of several folders, listing up to MAX_BATCH_REQUESTS folders per request.
+        Returns one list of items per endpoint, in order. Sub-requests that fail inside the
+        batch (e.g. throttled ones) are retried on their own; a folder that still can't be
+        listed gets None, so it doesn't take the rest of the batch with it.
+        """
+        results = []
+        for start in range(0, len(endpoints), MAX_BATCH_REQUESTS):
+            chunk = endpoints[start:start + MAX_BATCH_REQUESTS]
+            responses = self.batch([f"{endpoint}?$top=999" for endpoint in chunk])
+            for endpoint, response in zip(chunk, responses):
+                if response.get('status') != 200:
+                    try:
+                        results.append(self.get_children(endpoint))
+                    except Exception as e:
+                        logging.error(f"Error listing {endpoint}: {str(e)}")
+                        results.append(None)
+                    continue
+
+                body = response.get('body', {})
+                items = body.get('value', [])
+                next_link = body.get('@odata.nextLink')
+                if next_link:
+                    for page in self._paginate(next_link.replace(self.base_url + '/', '')):
+                        items.extend(page.get('value', []))
+                results.append(items)
+        return results
+
+    def iter_delta(self, delta_link=None):
+        """
+        Yield each page of changes since the last sync using delta query.
         If delta_link is provided, it will be used to get only changes since the last query.
+        The last page carries the @odata.deltaLink for the next sync.
         """
         try:
-            site_id = self.get_site_id()
-            drive_id = self.get_drive_id()
-
             if delta_link:
                 endpoint = delta_link.replace(self.base_url + '/', '')
             else:
+                site_id = self.get_site_id()
+                drive_id = self.get_drive_id()
                 endpoint = f"sites/{site_id}/drives/{drive_id}/root/delta"
 
-            return self._make_request(endpoint)
+            yield from self._paginate(endpoint, params=None if delta_link else DELTA_PARAMS)
 
         except Exception as e:
             logging.error(f"Error getting delta changes: {str(e)}")
             raise
 
-    def download_file(self, item):
+    def get_delta(self, delta_link=None):
+        """
+        Get changes since the last sync using delta query.
+        If delta_link is provided, it will be used to get only changes since the last query.
+
+        All pages are fetched; the result holds every item plus the final @odata.deltaLink.
+        """
+        items = []
+        page = {}
+        for page in self.iter_delta(delta_link):
+            items.extend(page.get('value', []))
+
+        result = {'value': items}
+        if '@odata.deltaLink' in page:
+            result['@odata.deltaLink'] = page['@odata.deltaLink']
+        return result
+
+    def get_latest_delta_link(self):
+        """
+        Get a delta link for the drive's current state without enumerating it.
+        Changes made after this call are returned by get_delta(delta_link).
+        """
+        site_id = self.get_site_id()
+        drive_id = self.get_drive_id()
+        response = self._make_request(f"sites/{site_id}/drives/{drive_id}/root/delta",
+                                      params={**DELTA_PARAMS, 'token': 'latest'})
+        return response.get('@odata.deltaLink')
+
+    def create_subscription(self, notification_url, expiration, client_state):
+        """
+        Subscribe to change notifications for the drive.
+        Graph validates notification_url before it responds, so it must already be reachable.
+        """
+        drive_id = self.get_drive_id()
+        response = self._make_request("subscriptions", method="POST", data={
+            "changeType": "updated",
+            "notificationUrl": notification_url,
+            "resource": f"drives/{drive_id}/root",
+            "expirationDateTime": expiration,
+            "clientState": client_state
+        })
+        return loads(response.content)
+
+    def renew_subscription(self, subscription_id, expiration):
+        """
+        Extend a change notification subscription.
+        """
+        self._make_request(f"subscriptions/{subscription_id}", method="PATCH",
+                           data={"expirationDateTime": expiration})
+
+    def delete_subscription(self, subscription_id):
+        """
+        Delete a change notification subscription.
+        """
+        self._make_request(f"subscriptions/{subscription_id}", method="DELETE")
+
+    def download_file(self, item, parent_path=None, etag=None):
         """
         Download a file from SharePoint.
+
+        parent_path can be given when the item has no usable parentReference path
+        (delta responses do not include one). etag is the ETag the server sent for the
+        local copy; when given, the download is conditional and nothing is transferred
+        if the server answers 304 Not Modified.
+
+        Returns (local_file_path, etag) with the ETag of the downloaded content;
+        local_file_path is None when the file was not modified.
         """
         try:
             # Get download URL
@@ -166,7 +349,8 @@ class SharePointClient:
                     raise Exception(f"Could not get download URL for file: {item.get('name')}")
 
             # Get the relative path of the file
-            parent_path = self._get_parent_path(item)
+            if parent_path is None:
+                parent_path = self._get_parent_path(item)
             file_name = item.get('name')
 
             # Create local directory structure if it doesn't exist
@@ -176,16 +360,50 @@ class SharePointClient:
             # Download the file
             local_file_path = os.path.join(local_dir, file_name)
 
+            # Written to a .part file that replaces the local file once complete
+            part_path = local_file_path + '.part'
+            tag_path = part_path + '.tag'
+            remote_size = item.get('size')
+            remote_tag = item.get('eTag') or item.get('cTag')
+            offset = _part_offset(part_path, tag_path, remote_size, remote_tag)
+
             # Stream download
-            response = requests.get(download_url, stream=True)
+            if offset:
+                headers = {'Range': f'bytes={offset}-', 'If-Range': remote_tag}
+            elif etag:
+                headers = {'If-None-Match': etag}
+            else:
+                headers = None
+            response = self.session.get(download_url, stream=True, headers=headers)
+            if response.status_code == 304:
+                # The local copy is current; don't read a body
+                response.close()
+                return None, etag
             response.raise_for_status()
 
-            with open(local_file_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+            if offset and response.status_code != 206:
+                # The server sent the whole file
+                offset = 0
+            elif offset:
+                logging.info(f"Resuming download of {file_name} from byte {offset}")
+
+            # Copy in 1 MiB blocks in C; the file is unbuffered since the blocks are already large
+            response.raw.decode_content = True
+            with open(part_path, 'ab' if offset else 'wb', buffering=0) as f:
+                if not offset:
+                    _write_part_tag(tag_path, remote_tag)
+                shutil.copyfileobj(response.raw, f, length=1024 * 1024)
+                written = f.tell()
+                os.fsync(f.fileno())
+
+            if remote_size and written != remote_size:
+                _remove_files(part_path, tag_path)
+                raise Exception(f"Downloaded size {written} does not match expected size {remote_size}")
+            os.replace(part_path, local_file_path)
+            _remove_files(tag_path)
 
             logging.info(f"Downloaded: {local_file_path}")
-            return local_file_path
+            return local_file_path, response.headers.get('ETag')
 
         except Exception as e:
             logging.error(f"Error downloading file {item.get('name')}: {str(e)}")
@@ -2,12 +2,35 @@
 Sync manager for handling SharePoint delta synchronization.
 """
 import os
-import json
+import shutil
 import logging
-import time
-from datetime import datetime
+import signal
+import sqlite3
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+try:
+    from ciso8601 import parse_datetime
+except ImportError:
+    parse_datetime = None
+from json_utils import load_file
 from sharepoint_client import SharePointClient
-from config import STATE_FILE, FILE_TYPES_TO_EXCLUDE, PATHS_TO_EXCLUDE, SYNC_INTERVAL_MINUTES
+from config import (STATE_FILE, DELTA_STATE_DB_FILE, EXCLUDE_EXTS, EXCLUDE_PATH_RE, SYNC_INTERVAL_MINUTES,
+                    STATE_SAVE_INTERVAL, MAX_DOWNLOAD_WORKERS)
+
+def parse_remote_mtime(value):
+    """
+    Convert a Graph API ISO 8601 timestamp (e.g. '2024-01-31T12:00:00Z') to a POSIX timestamp.
+    Returns None if the value is missing.
+    """
+    if not value:
+        return None
+    if parse_datetime is not None:
+        return parse_datetime(value).timestamp()
+    if value.endswith('Z'):
+        return datetime.fromisoformat(value[:-1]).replace(tzinfo=timezone.utc).timestamp()
+    return datetime.fromisoformat(value).timestamp()
 
 class SyncManager:
     """
@@ -17,154 +40,323 @@ class SyncManager:
     def __init__(self):
         """Initialize the sync manager."""
         self.client = SharePointClient()
-        self.state_file = STATE_FILE
+        # Download folder with a trailing separator; local paths are this plus the item's
+        # relative path, so each item needs only one join
+        self._root = os.path.join(self.client.download_path, '')
+        self.state_file = DELTA_STATE_DB_FILE
         self.delta_link = None
         self.last_sync = None
+        self.last_changed = 0  # Items the last successful sync found changed
+        # Set to end continuous sync; wakes it from waiting for the next sync
+        self._stop = threading.Event()
+        # Item ID -> local path, modification time, cTag and size, kept in SQLite
+        self._db = None
+        self._dirty = 0  # Items processed since the state was last committed
+        self._sync_started_iso = None  # Start time of the current sync, reused by every save
+        # Guards the database connection and the dirty counter while files download in parallel
+        self._lock = threading.RLock()
+        self._handlers = {
+            'deleted': self.handle_deletion,
+            'folder': self.handle_folder,
+            'file': self.handle_file,
+            'unknown': self._log_unknown,
+        }
         self.load_state()
 
+    def _open_db(self):
+        """Open the state database, creating the tables if needed."""
+        # Autocommit mode; each sync runs in explicit transactions committed by save_state
+        db = sqlite3.connect(self.state_file, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        # etag holds the item's cTag, which only changes when the file content changes
+        # and download_etag the HTTP ETag of the downloaded copy, for conditional downloads
+        db.execute("CREATE TABLE IF NOT EXISTS items "
+                   "(id TEXT PRIMARY KEY, path TEXT, mtime REAL, etag TEXT, size INTEGER, download_etag TEXT)")
+        db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        # Databases created before download_etag was added
+        columns = {row[1] for row in db.execute("PRAGMA table_info(items)")}
+        if "download_etag" not in columns:
+            db.execute("ALTER TABLE items ADD COLUMN download_etag TEXT")
+        return db
+
+    def _import_json_state(self):
+        """
+        Copy the state from the old JSON state file into the (empty) database, so
+        existing installs keep their delta link and item paths.
+        """
+        if not os.path.exists(STATE_FILE):
+            return
+        state = load_file(STATE_FILE)
+
+        # The manual sync manager used to write a different format to the same file
+        if "paths" not in state:
+            return
+
+        logging.info(f"Importing sync state from old state file: {STATE_FILE}")
+        etags = state.get("etags", {})
+        self._db.execute("BEGIN")
+        self._db.executemany("INSERT OR REPLACE INTO items (id, path, etag) VALUES (?, ?, ?)",
+                             [(item_id, path, etags.get(item_id))
+                              for item_id, path in state.get("paths", {}).items()])
+        self._db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                             [("last_sync", state.get("last_sync")), ("delta_link", state.get("delta_link"))])
+        self._db.execute("COMMIT")
+
     def load_state(self):
         """Load previous sync state including delta link."""
         try:
-            if os.path.exists(self.state_file):
-                with open(self.state_file, 'r') as f:
-                    state = json.load(f)
-                    self.delta_link = state.get("delta_link")
-                    self.last_sync = state.get("last_sync")
-                    logging.info(f"Loaded sync state. Last sync: {self.last_sync}")
-                    return True
+            is_new = not os.path.exists(self.state_file)
+            self._db = self._open_db()
+            if is_new:
+                self._import_json_state()
+
+            meta = dict(self._db.execute("SELECT key, value FROM meta"))
+            self.delta_link = meta.get("delta_link")
+            self.last_sync = meta.get("last_sync")
+            if self.delta_link:
+                logging.info(f"Loaded sync state. Last sync: {self.last_sync}")
+                return True
             logging.info("No previous sync state found. Will perform full sync.")
             return False
         except Exception as e:
             logging.error(f"Error loading sync state: {str(e)}")
             return False
 
+    def _begin(self):
+        """Start a transaction for the following state changes, unless one is already open."""
+        with self._lock:
+            if self._db and not self._db.in_transaction:
+                self._db.execute("BEGIN")
+
+    def _get_item(self, item_id):
+        """Get the stored (path, etag, download_etag) of an item, or None if it isn't known."""
+        with self._lock:
+            return self._db.execute("SELECT path, etag, download_etag FROM items WHERE id = ?",
+                                    (item_id,)).fetchone()
+
+    def _set_item(self, item_id, path, mtime=None, etag=None, size=None, download_etag=None):
+        """Record an item's local path (and for files, what was downloaded)."""
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO items (id, path, mtime, etag, size, download_etag) "
+                             "VALUES (?, ?, ?, ?, ?, ?)",
+                             (item_id, path, mtime, etag, size, download_etag))
+
     def save_state(self):
-        """Save current sync state."""
+        """
+        Save current sync state.
+        Items are written to the database as they change, so this records the delta link
+        and sync time and commits the open transaction.
+        """
         try:
-            state = {
-                "delta_link": self.delta_link,
-                "last_sync": datetime.now().isoformat()
-            }
-            with open(self.state_file, 'w') as f:
-                json.dump(state, f)
+            with self._lock:
+                self._db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                     [("delta_link", self.delta_link),
+                                      ("last_sync", self._sync_started_iso or datetime.now().isoformat())])
+                if self._db.in_transaction:
+                    self._db.execute("COMMIT")
+                self._dirty = 0
             logging.info("Saved sync state.")
         except Exception as e:
             logging.error(f"Error saving sync state: {str(e)}")
 
-    def should_process_item(self, item):
+    def should_process_item(self, item, kind=None, parent_path=None):
         """
         Determine if an item should be processed based on exclusion rules.
         """
         # Skip deleted items (we'll handle them separately)
-        if item.get('deleted'):
+        if kind == 'deleted' or (kind is None and item.get('deleted')):
             return True
 
         # Check file extension exclusions
         name = item.get('name', '')
-        if any(name.lower().endswith(ext.lower()) for ext in FILE_TYPES_TO_EXCLUDE):
-            logging.info(f"Skipping excluded file type: {name}")
+        if EXCLUDE_EXTS and name.lower().endswith(EXCLUDE_EXTS):
+            logging.debug("Skipping excluded file type: %s", name)
             return False
 
-        # Check path exclusions
-        parent_path = self.client._get_parent_path(item)
-        full_path = os.path.join(parent_path, name)
-        if any(excl_path in full_path for excl_path in PATHS_TO_EXCLUDE):
-            logging.info(f"Skipping excluded path: {full_path}")
-            return False
+        # Check path exclusions (the parent path is only needed when there are any)
+        if EXCLUDE_PATH_RE:
+            if parent_path is None:
+                parent_path = self._resolve_parent_path(item)
+            # Graph paths always use '/', so a plain concatenation is enough
+            full_path = f"{parent_path}/{name}" if parent_path else name
+            if EXCLUDE_PATH_RE.search(full_path):
+                logging.debug("Skipping excluded path: %s", full_path)
+                return False
 
         return True
 
-    def process_item(self, item):
+    @staticmethod
+    def classify_item(item):
+        """Get the kind of a changed item: 'deleted', 'folder', 'file' or 'unknown'."""
+        return ('deleted' if 'deleted' in item else
+                'folder' if 'folder' in item else
+                'file' if 'file' in item else
+                'unknown')
+
+    def process_item(self, item, kind=None):
         """
         Process a changed item (file or folder).
+        kind can be given when the caller already classified the item.
+        Returns the item kind ('deleted', 'folder', 'file' or 'unknown'), or None if it was skipped.
         """
         try:
-            # Skip items that match exclusion rules
-            if not self.should_process_item(item):
-                return
+            # Classify the item once and dispatch on the result
+            if kind is None:
+                kind = self.classify_item(item)
 
-            # Handle deleted items
-            if item.get('deleted'):
-                self.handle_deletion(item)
-                return
+            # The drive root has no parent; its id is recorded so items in it resolve to ''
+            if 'root' in item:
+                self._set_item(item.get('id'), '')
+                return None
 
-            name = item.get('name', '')
-            item_id = item.get('id')
+            # Resolve the parent path once for the items that need it
+            parent_path = (self._resolve_parent_path(item)
+                           if kind in ('folder', 'file') else None)
 
-            # Handle folder
-            if 'folder' in item:
-                self.handle_folder(item)
-            # Handle file
-            elif 'file' in item:
-                self.handle_file(item)
-            else:
-                logging.warning(f"Unknown item type: {name}")
+            # Skip items that match exclusion rules
+            if not self.should_process_item(item, kind, parent_path):
+                return None
+
+            self._handlers[kind](item, parent_path)
+
+            # Commit periodically so a long sync doesn't lose all its changes on a crash
+            with self._lock:
+                self._dirty += 1
+                if self._dirty >= STATE_SAVE_INTERVAL:
+                    self.save_state()
+                    self._begin()
+            return kind
 
         except Exception as e:
             logging.error(f"Error processing item {item.get('name', 'unknown')}: {str(e)}")
+            return None
 
-    def handle_folder(self, item):
+    def _resolve_parent_path(self, item):
+        """
+        Get an item's parent path relative to the download folder.
+        Delta items carry no parentReference path, so the parent is looked up by id among
+        the recorded items; the parentReference path is only used for unknown parents.
+        """
+        parent_id = item.get('parentReference', {}).get('id')
+        if parent_id:
+            stored = self._get_item(parent_id)
+            if stored and stored[0] is not None:
+                return stored[0]
+        return self.client._get_parent_path(item)
+
+    def _log_unknown(self, item, parent_path=None):
+        """
+        Log an item that is neither a file, a folder nor a deletion.
+        """
+        logging.warning(f"Unknown item type: {item.get('name', '')}")
+
+    def handle_folder(self, item, parent_path=None):
         """
         Handle a folder item - create the folder locally if it doesn't exist.
         """
         try:
             name = item.get('name', '')
-            parent_path = self.client._get_parent_path(item)
-            folder_path = os.path.join(self.client.download_path, parent_path, name)
-
-            if not os.path.exists(folder_path):
-                os.makedirs(folder_path, exist_ok=True)
+            if parent_path is None:
+                parent_path = self._resolve_parent_path(item)
+            # Joined with '/' like Graph paths, so stored paths have one form on every platform
+            relative_path = f"{parent_path}/{name}" if parent_path else name
+            folder_path = self._root + relative_path
+
+            # makedirs checks for the folder itself, so no separate exists() call
+            try:
+                os.makedirs(folder_path)
                 logging.info(f"Created folder: {folder_path}")
+            except FileExistsError:
+                pass
+
+            self._set_item(item.get('id'), relative_path)
 
         except Exception as e:
             logging.error(f"Error handling folder {item.get('name', 'unknown')}: {str(e)}")
 
-    def handle_file(self, item):
+    def handle_file(self, item, parent_path=None):
         """
         Handle a file item - download the file.
         """
         try:
             name = item.get('name', '')
-            parent_path = self.client._get_parent_path(item)
-            file_path = os.path.join(self.client.download_path, parent_path, name)
-
-            # Check if file exists and compare modification times
-            if os.path.exists(file_path):
-                local_mtime = datetime.fromtimestamp(os.path.getmtime(file_path))
-                remote_mtime_str = item.get('lastModifiedDateTime')
-
-                if remote_mtime_str:
-                    remote_mtime = datetime.fromisoformat(remote_mtime_str.replace('Z', '+00:00'))
+            if parent_path is None:
+                parent_path = self._resolve_parent_path(item)
+            # Joined with '/' like Graph paths, so stored paths have one form on every platform
+            relative_path = f"{parent_path}/{name}" if parent_path else name
+            file_path = self._root + relative_path
+
+            # Check if file exists and compare modification times (one stat call)
+            try:
+                local_mtime = os.stat(file_path).st_mtime
+            except FileNotFoundError:
+                local_mtime = None
 
+            item_id = item.get('id')
+            ctag = item.get('cTag')
+            remote_mtime = parse_remote_mtime(item.get('lastModifiedDateTime'))
+            stored = self._get_item(item_id) if local_mtime is not None else None
+
+            skip_reason = None
+            if local_mtime is not None:
+                stored_ctag = stored[1] if stored else None
+                if stored_ctag is not None and ctag:
+                    # The content tag only changes when the file content changes
+                    if stored_ctag == ctag:
+                        skip_reason = "content unchanged"
+                else:
                     # Skip download if local file is newer or same age
-                    if local_mtime >= remote_mtime:
-                        logging.info(f"Skipping file (local copy is up-to-date): {name}")
-                        return
+                    if remote_mtime is not None and local_mtime >= remote_mtime:
+                        skip_reason = "local copy is up-to-date"
+
+            download_etag = stored[2] if stored else None
+            if skip_reason:
+                logging.debug("Skipping file (%s): %s", skip_reason, name)
+            else:
+                # Download the file; if the local copy came from an earlier download, only when
+                # the server's copy differs from it
+                logging.info(f"Downloading file: {name}")
+                downloaded, download_etag = self.client.download_file(item, parent_path, download_etag)
+                if downloaded is None:
+                    logging.debug("Skipping file (not modified on server): %s", name)
 
-            # Download the file
-            logging.info(f"Downloading file: {name}")
-            self.client.download_file(item)
+            # Skipped files are recorded too, so a later deletion on the server finds their path
+            self._set_item(item_id, relative_path, remote_mtime, ctag, item.get('size'), download_etag)
 
         except Exception as e:
             logging.error(f"Error handling file {item.get('name', 'unknown')}: {str(e)}")
 
-    def handle_deletion(self, item):
+    def handle_deletion(self, item, parent_path=None):
         """
         Handle a deleted item - delete it locally if it exists.
         """
         try:
-            # For deleted items, we need to use the ID to figure out what was deleted
+            # Deleted items carry no path, so look it up from the ID
             item_id = item.get('id')
-
-            # This is tricky because we don't have the path anymore
-            # We would need to maintain a mapping of item IDs to local paths
-            # For simplicity, we'll log the deletion but not act on it
             logging.info(f"Item with ID {item_id} was deleted in SharePoint")
 
-            # In a more complete implementation, you would:
-            # 1. Maintain a database of item IDs to local paths
-            # 2. Look up the local path for this ID
-            # 3. Delete the local file or folder
+            stored = self._get_item(item_id)
+            if not stored or not stored[0]:
+                logging.info(f"No local path recorded for item ID {item_id}")
+                return
+
+            relative_path = stored[0]
+            with self._lock:
+                self._db.execute("DELETE FROM items WHERE id = ?", (item_id,))
+                # Anything recorded below a deleted folder goes with it; stored paths can mix
+                # os.sep with the '/' of Graph parent paths, so both sides are compared with '/'
+                prefix = relative_path.replace(os.sep, '/') + '/'
+                self._db.execute("DELETE FROM items WHERE substr(replace(path, ?, '/'), 1, ?) = ?",
+                                 (os.sep, len(prefix), prefix))
+
+            local_path = self._root + relative_path
+            if os.path.isdir(local_path):
+                shutil.rmtree(local_path)
+                logging.info(f"Deleted folder: {local_path}")
+            elif os.path.exists(local_path):
+                os.remove(local_path)
+                logging.info(f"Deleted file: {local_path}")
 
         except Exception as e:
             logging.error(f"Error handling deletion for item ID {item.get('id', 'unknown')}: {str(e)}")
@@ -175,20 +367,43 @@ class SyncManager:
         """
         try:
             logging.info("Starting sync process...")
-
-            # Get changes since last sync
-            delta_response = self.client.get_delta(self.delta_link)
-
-            # Process each changed item
-            items = delta_response.get('value', [])
-            logging.info(f"Found {len(items)} changed items")
-
-            for item in items:
-                self.process_item(item)
+            self._sync_started_iso = datetime.now().isoformat()
+
+            # Collect this sync's state changes in a transaction, committed by save_state
+            self._begin()
+
+            # Process the changes page by page as they arrive, tallying item kinds.
+            # Folders and deletions are applied in order on this thread; file downloads
+            # start on the pool right away, while the remaining pages are still being fetched.
+            counts = Counter()
+            new_delta_link = None
+            changed = 0
+            with ThreadPoolExecutor(max_workers=MAX_DOWNLOAD_WORKERS) as executor:
+                downloads = []
+                classify_item = self.classify_item
+                for page in self.client.iter_delta(self.delta_link):
+                    new_delta_link = page.get('@odata.deltaLink', new_delta_link)
+                    items = page.get('value', [])
+                    changed += len(items)
+                    for item in items:
+                        # One classification per item, shared with process_item
+                        kind = classify_item(item)
+                        if kind == 'file':
+                            downloads.append(executor.submit(self.process_item, item, kind))
+                        else:
+                            counts[self.process_item(item, kind)] += 1
+
+                for future in downloads:
+                    counts[future.result()] += 1
+            logging.info(f"Found {changed} changed items")
+            self.last_changed = changed
+
+            logging.info(f"Processed {counts['file']} files, {counts['folder']} folders "
+                         f"and {counts['deleted']} deletions ({counts[None]} skipped)")
 
             # Save the delta link for next sync
-            if '@odata.deltaLink' in delta_response:
-                self.delta_link = delta_response['@odata.deltaLink']
+            if new_delta_link:
+                self.delta_link = new_delta_link
                 self.save_state()
 
             logging.info("Sync completed successfully")
@@ -198,28 +413,46 @@ class SyncManager:
             logging.error(f"Error during sync: {str(e)}")
             return False
 
+    def stop(self):
+        """Stop continuous sync after the current sync (or right away if it is waiting)."""
+        self._stop.set()
+
     def run_continuous_sync(self):
         """
         Run the sync process continuously at specified intervals.
+        After a sync that found changes the next one runs sooner (a quarter of the interval,
+        but at least a minute later), since more changes often follow.
+        SIGTERM stops the loop cleanly, like Ctrl+C.
         """
+        previous_handler = None
+        if threading.current_thread() is threading.main_thread():
+            previous_handler = signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
         try:
             logging.info(f"Starting continuous sync (interval: {SYNC_INTERVAL_MINUTES} minutes)")
 
-            while True:
+            interval = SYNC_INTERVAL_MINUTES * 60
+            while not self._stop.is_set():
                 success = self.perform_sync()
 
-                if success:
-                    logging.info(f"Waiting {SYNC_INTERVAL_MINUTES} minutes until next sync...")
+                if not success:
+                    wait = interval
+                    logging.warning(f"Sync failed. Will retry in {wait / 60:g} minutes...")
                 else:
-                    logging.warning(f"Sync failed. Will retry in {SYNC_INTERVAL_MINUTES} minutes...")
+                    wait = max(interval / 4, 60) if self.last_changed else interval
+                    logging.info(f"Waiting {wait / 60:g} minutes until next sync...")
 
-                # Sleep until next sync
-                time.sleep(SYNC_INTERVAL_MINUTES * 60)
+                # Wait until the next sync or until stopped; the event's wait is based on the
+                # monotonic clock, so changes to the system time don't shift it
+                if self._stop.wait(wait):
+                    logging.info("Sync process stopped")
 
         except KeyboardInterrupt:
             logging.info("Sync process interrupted by user")
         except Exception as e:
             logging.error(f"Unexpected error in continuous sync: {str(e)}")
+        finally:
+            if previous_handler is not None:
+                signal.signal(signal.SIGTERM, previous_handler)
 
     def run_one_time_sync(self):
         """
@@ -5,18 +5,36 @@ This script tests different authentication approaches and provides detailed diag
 import os
 import sys
 import json
+import atexit
 import logging
+from logging.handlers import MemoryHandler
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
+from requests.adapters import HTTPAdapter
 import msal
 from dotenv import load_dotenv
 
 # Set up logging
+# None of the formats use thread or process info, so skip collecting it per record
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
+
+# File output keeps timestamps and is buffered in memory and written in batches
+# (and on errors or exit); the console gets a lighter format without asctime
+file_handler = logging.FileHandler("auth_troubleshoot.log")
+file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+buffered_file_handler = MemoryHandler(capacity=1024, flushLevel=logging.ERROR, target=file_handler)
+atexit.register(buffered_file_handler.flush)
+
+console_handler = logging.StreamHandler(sys.stdout)
+console_handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+
 logging.basicConfig(
     level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler("auth_troubleshoot.log"),
-        logging.StreamHandler(sys.stdout)
+        buffered_file_handler,
+        console_handler
     ]
 )
 
@@ -60,9 +78,24 @@ logging.info(f"Site URL: {site_url}")
 logging.info(f"Client Secret (first 4 chars): {client_secret[:4]}...")
 logging.info(f"Client Secret ID (first 4 chars): {client_secret_id[:4]}...")
 
+# Approaches tested at the same time; matches the session's connection pool size
+MAX_PARALLEL_APPROACHES = 4
+
+# One session for every request the script makes, so the connections to the login
+# endpoint and to Graph are opened once and reused by each approach
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=MAX_PARALLEL_APPROACHES))
+
+# Shared by every approach, so a token already acquired for the same authority and
+# scopes is served from the cache instead of another request to the login endpoint
+token_cache = msal.SerializableTokenCache()
+
 # Test different authentication approaches
-def test_auth_approach(approach_name, authority, scopes, credential):
-    """Test a specific authentication approach and return the result."""
+def test_auth_approach(approach_name, authority, scopes, credential, session):
+    """
+    Test a specific authentication approach.
+    Returns (success, token, error), where error is the MSAL error description on failure.
+    """
     logging.info(f"\nTesting authentication approach: {approach_name}")
     logging.info(f"Authority: {authority}")
     logging.info(f"Scopes: {scopes}")
@@ -71,7 +104,9 @@ def test_auth_approach(approach_name, authority, scopes, credential):
         app = msal.ConfidentialClientApplication(
             client_id,
             authority=authority,
-            client_credential=credential
+            client_credential=credential,
+            http_client=session,
+            token_cache=token_cache
         )
         
         logging.info("MSAL application created successfully")
@@ -84,61 +119,70 @@ def test_auth_approach(approach_name, authority, scopes, credential):
             token_preview = token[:10] + "..." + token[-10:]
             logging.info(f"Successfully acquired token: {token_preview}")
             
-            # Test the token with a simple Graph API call
+            # Test the token against /me and the SharePoint site in a single $batch round trip
             headers = {
                 "Authorization": f"Bearer {token}",
                 "Accept": "application/json"
             }
             
-            logging.info("Testing token with Graph API call to /me...")
-            response = requests.get(
-                "https://graph.microsoft.com/v1.0/me",
-                headers=headers
-            )
-            
-            logging.info(f"Response status code: {response.status_code}")
-            if response.status_code == 200:
-                logging.info("Token works for /me endpoint")
-            else:
-                logging.info(f"Token doesn't work for /me endpoint: {response.text}")
-            
-            # Test with SharePoint site
-            logging.info(f"Testing token with SharePoint site: {site_url}")
             site_parts = site_url.split('/')
             hostname = site_parts[2]  # e.g., contoso.sharepoint.com
             
             if '/sites/' in site_url:
                 site_name = site_url.split('/sites/')[1].split('/')[0]
-                graph_url = f"https://graph.microsoft.com/v1.0/sites/{hostname}:/sites/{site_name}"
+                site_path = f"/sites/{hostname}:/sites/{site_name}"
             else:
-                graph_url = f"https://graph.microsoft.com/v1.0/sites/{hostname}"
+                site_path = f"/sites/{hostname}"
             
-            logging.info(f"Making request to: {graph_url}")
-            response = requests.get(
-                graph_url,
-                headers=headers
+            logging.info(f"Testing token with Graph API calls to /me and SharePoint site: {site_url}")
+            response = session.post(
+                "https://graph.microsoft.com/v1.0/$batch",
+                headers=headers,
+                json={"requests": [
+                    {"id": "me", "method": "GET", "url": "/me"},
+                    {"id": "site", "method": "GET", "url": site_path}
+                ]}
             )
             
-            logging.info(f"Response status code: {response.status_code}")
-            if response.status_code == 200:
+            logging.info(f"Batch response status code: {response.status_code}")
+            if response.status_code != 200:
+                logging.info(f"Batch request failed: {response.text}")
+                return True, token, None
+            
+            results = {r["id"]: r for r in response.json().get("responses", [])}
+            me_result = results.get("me", {})
+            site_result = results.get("site", {})
+            
+            logging.info(f"/me status code: {me_result.get('status')}")
+            if me_result.get("status") == 200:
+                logging.info("Token works for /me endpoint")
+            else:
+                logging.info(f"Token doesn't work for /me endpoint: {me_result.get('body')}")
+            
+            logging.info(f"Site status code: {site_result.get('status')}")
+            if site_result.get("status") == 200:
                 logging.info("Token works for SharePoint site!")
-                site_data = response.json()
+                site_data = site_result.get("body", {})
                 logging.info(f"Site name: {site_data.get('displayName')}")
                 logging.info(f"Site ID: {site_data.get('id')}")
-                return True, token
+                return True, token, None
             else:
-                logging.info(f"Token doesn't work for SharePoint site: {response.text}")
+                logging.info(f"Token doesn't work for SharePoint site: {site_result.get('body')}")
             
-            return True, token
+            return True, token, None
         else:
             error = result.get("error", "unknown")
             error_description = result.get("error_description", "No description")
             logging.error(f"Failed to acquire token: {error} - {error_description}")
-            return False, None
+            return False, None, error_description
     
     except Exception as e:
         logging.error(f"Exception during authentication: {str(e)}")
-        return False, None
+        return False, None, str(e)
+
+def secret_of(credential):
+    """Get the client secret a credential (a string or a dict) authenticates with."""
+    return credential.get("secret") if isinstance(credential, dict) else credential
 
 # Test different approaches
 approaches = [
@@ -186,25 +230,60 @@ approaches = [
     }
 ]
 
-# Try each approach
+# Approaches to try, keyed by what is actually sent to the login endpoint so the same
+# request is only made once (a dict with only a secret is the same as the bare secret)
+tried = {}
+to_try = []
+for approach in approaches:
+    credential = approach["credential"]
+    if isinstance(credential, dict) and set(credential) == {"secret"}:
+        credential = credential["secret"]
+    key = (approach["authority"], json.dumps(credential, sort_keys=True), tuple(approach["scopes"]))
+    if key in tried:
+        logging.info(f"\nSkipping approach: {approach['name']} (same request as: {tried[key]})")
+        continue
+    tried[key] = approach["name"]
+    to_try.append((approach, credential))
+
+# Try the approaches in parallel, since they don't depend on each other; the first one
+# that works wins and the ones that haven't started yet are cancelled
 success = False
 working_token = None
 
-for approach in approaches:
-    result, token = test_auth_approach(
-        approach["name"],
-        approach["authority"],
-        approach["scopes"],
-        approach["credential"]
-    )
-    
-    if result:
-        success = True
-        working_token = token
-        logging.info(f"\n✅ SUCCESS with approach: {approach['name']}")
-        break
-    else:
-        logging.info(f"\n❌ FAILED with approach: {approach['name']}")
+with ThreadPoolExecutor(max_workers=MAX_PARALLEL_APPROACHES) as executor:
+    futures = {
+        executor.submit(
+            test_auth_approach,
+            approach["name"],
+            approach["authority"],
+            approach["scopes"],
+            credential,
+            session
+        ): (approach, credential)
+        for approach, credential in to_try
+    }
+
+    for future in as_completed(futures):
+        if future.cancelled():
+            continue
+        approach, credential = futures[future]
+        result, token, error = future.result()
+
+        if result:
+            success = True
+            working_token = token
+            logging.info(f"\n✅ SUCCESS with approach: {approach['name']}")
+            for other in futures:
+                other.cancel()
+            break
+        else:
+            logging.info(f"\n❌ FAILED with approach: {approach['name']}")
+            if error and "AADSTS7000215" in error:
+                # Every other variant sends the same secret, so it would be rejected the same way
+                for other, (other_approach, other_credential) in futures.items():
+                    if secret_of(other_credential) == secret_of(credential) and other.cancel():
+                        logging.info(f"\nSkipping approach: {other_approach['name']} "
+                                     "(the client secret was rejected as invalid)")
 
 if success:
     logging.info("\n=== AUTHENTICATION SUCCESSFUL ===")
@@ -231,7 +310,7 @@ if success:
     
     # Get the site
     logging.info(f"Getting site information from: {site_endpoint}")
-    response = requests.get(
+    response = session.get(
         f"https://graph.microsoft.com/v1.0/{site_endpoint}",
         headers=headers
     )
@@ -243,7 +322,7 @@ if success:
         
         # Get drives
         logging.info(f"Getting drives for site ID: {site_id}")
-        response = requests.get(
+        response = session.get(
             f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives",
             headers=headers
         )
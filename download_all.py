@@ -3,8 +3,31 @@ Script to download all files from SharePoint/OneDrive automatically.
 """
 import os
 import sys
+import queue
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from src.graph_client import GraphClient
-from src.config import DOWNLOAD_PATH
+from src.config import DOWNLOAD_PATH, MAX_DOWNLOAD_WORKERS
+
+logger = logging.getLogger(__name__)
+
+def setup_logging():
+    """
+    Send log messages through a queue to a single thread that writes them to stdout,
+    so the worker threads never contend for the console. GraphClient's messages go
+    the same way.
+    """
+    log_queue = queue.Queue()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = QueueListener(log_queue, handler)
+    for queued_logger in (logger, logging.getLogger("src")):
+        queued_logger.addHandler(QueueHandler(log_queue))
+        queued_logger.setLevel(logging.INFO)
+        queued_logger.propagate = False
+    listener.start()
+    return listener
 
 def download_all_files():
     """Download all files from the user's OneDrive/SharePoint."""
@@ -15,12 +38,14 @@ def download_all_files():
     print("Files will be saved to the 'downloads' folder.")
     print("=" * 80)
     
+    listener = setup_logging()
+
     # Initialize the Graph client
     try:
         client = GraphClient()
         
         # Get available drives
-        print("\nFetching available drives...")
+        logger.info("\nFetching available drives...")
         drives_response = client.get_drives()
         
         # Handle both single drive and multiple drives responses
@@ -31,81 +56,106 @@ def download_all_files():
             drives = [drives_response]
         
         if not drives:
-            print("No drives found. Make sure your account has access to OneDrive or SharePoint.")
+            logger.info("No drives found. Make sure your account has access to OneDrive or SharePoint.")
             return
         
-        # Process each drive
-        for drive in drives:
-            drive_id = drive.get("id")
-            drive_name = drive.get("name", "Personal Drive")
-            drive_type = drive.get("driveType", "personal")
-            
-            print(f"\nProcessing drive: {drive_name} ({drive_type})")
-            
-            # Create a folder for this drive
-            drive_folder = os.path.join(DOWNLOAD_PATH, drive_name)
-            os.makedirs(drive_folder, exist_ok=True)
-            
-            # Download all content from the drive
-            download_folder_recursive(client, drive_id, "root", "", drive_name)
+        # One pool for all drives; listing a folder queues its subfolders and files on it
+        with ThreadPoolExecutor(max_workers=MAX_DOWNLOAD_WORKERS) as executor:
+            pending = set()
+
+            # Process each drive
+            for drive in drives:
+                drive_id = drive.get("id")
+                drive_name = drive.get("name", "Personal Drive")
+                drive_type = drive.get("driveType", "personal")
+                
+                logger.info(f"\nProcessing drive: {drive_name} ({drive_type})")
+                
+                # Create a folder for this drive
+                drive_folder = os.path.join(DOWNLOAD_PATH, drive_name)
+                os.makedirs(drive_folder, exist_ok=True)
+                
+                # Download all content from the drive
+                pending.add(executor.submit(list_folder, client, drive_id, "root", "", drive_name))
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    listing = future.result()
+                    if listing is None:
+                        # A finished download, or a folder that could not be listed
+                        continue
+                    drive_id, drive_name, path, folders, files = listing
+                    for item in folders:
+                        pending.add(executor.submit(list_folder, client, drive_id, item.get("id", ""),
+                                                    f"{path}/{item.get('name', '')}" if path else item.get("name", ""),
+                                                    drive_name))
+                    for item in files:
+                        pending.add(executor.submit(download_item, client, drive_id, item, path, drive_name))
             
-        print("\nDownload completed successfully!")
-        print(f"All files have been downloaded to: {os.path.abspath(DOWNLOAD_PATH)}")
+        logger.info("\nDownload completed successfully!")
+        logger.info(f"All files have been downloaded to: {os.path.abspath(DOWNLOAD_PATH)}")
         
     except Exception as e:
-        print(f"An error occurred: {str(e)}")
+        logger.error(f"An error occurred: {str(e)}")
+        # Let the listener print the error before prompting
+        listener.stop()
+        listener = None
         input("\nPress Enter to exit...")
+    finally:
+        if listener:
+            listener.stop()
 
-def download_folder_recursive(client, drive_id, folder_id, path, drive_name):
-    """Recursively download a folder and all its contents."""
+def list_folder(client, drive_id, folder_id, path, drive_name):
+    """
+    List a folder and create it locally.
+    Returns (drive_id, drive_name, path, folders, files) for the caller to queue, or None on error.
+    """
     try:
+        # Create the folder locally
+        os.makedirs(os.path.join(DOWNLOAD_PATH, drive_name, path), exist_ok=True)
+
         # Get items in the current folder
-        items_response = client.get_drive_items(drive_id, folder_id)
+        # Each folder is listed once, so the listing isn't cached
+        items_response = client.get_drive_items(drive_id, folder_id, cache=False)
         items = items_response.get("value", [])
         
         if not items:
-            print(f"No items found in {path or 'root'}")
-            return
+            logger.info(f"No items found in {path or 'root'}")
+            return None
         
-        # Process each item
-        for item in items:
-            item_name = item.get("name", "")
-            item_id = item.get("id", "")
-            
-            # Build the current path for display
-            current_path = f"{path}/{item_name}" if path else item_name
-            
-            if "folder" in item:
-                # It's a folder - process recursively
-                print(f"Processing folder: {current_path}")
-                
-                # Create the folder locally
-                folder_path = os.path.join(DOWNLOAD_PATH, drive_name, path, item_name)
-                os.makedirs(folder_path, exist_ok=True)
-                
-                # Download its contents
-                download_folder_recursive(client, drive_id, item_id, current_path, drive_name)
-            else:
-                # It's a file - download it
-                size = item.get("size", 0)
-                if size < 1024:
-                    size_str = f"{size} B"
-                elif size < 1024 * 1024:
-                    size_str = f"{size/1024:.1f} KB"
-                else:
-                    size_str = f"{size/(1024*1024):.1f} MB"
-                
-                print(f"Downloading file: {current_path} ({size_str})")
-                
-                # Prepare the local path
-                local_folder = os.path.join(DOWNLOAD_PATH, drive_name, path)
-                os.makedirs(local_folder, exist_ok=True)
+        folders = [item for item in items if "folder" in item]
+        files = [item for item in items if "folder" not in item]
+        for item in folders:
+            logger.info(f"Processing folder: {f'{path}/' if path else ''}{item.get('name', '')}")
+        return drive_id, drive_name, path, folders, files
                 
-                # Download the file
-                client.download_file(drive_id, item_id, item_name, os.path.join(drive_name, path))
+    except Exception as e:
+        logger.error(f"Error processing {path or 'root'}: {str(e)}")
+        return None
+
+def download_item(client, drive_id, item, path, drive_name):
+    """Download one file into its folder under the drive's download folder."""
+    item_name = item.get("name", "")
+    current_path = f"{path}/{item_name}" if path else item_name
+    try:
+        size = item.get("size", 0)
+        if size < 1024:
+            size_str = f"{size} B"
+        elif size < 1024 * 1024:
+            size_str = f"{size/1024:.1f} KB"
+        else:
+            size_str = f"{size/(1024*1024):.1f} MB"
+        
+        logger.info(f"Downloading file: {current_path} ({size_str})")
+        
+        # Download the file (list_folder already created its folder); no progress bar, since
+        # several files download at once
+        client.download_file(drive_id, item.get("id", ""), item_name, os.path.join(drive_name, path),
+                             progress=False)
                 
     except Exception as e:
-        print(f"Error processing {path or 'root'}: {str(e)}")
+        logger.error(f"Error downloading {current_path}: {str(e)}")
 
 if __name__ == "__main__":
     download_all_files()
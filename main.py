@@ -3,6 +3,7 @@ Main entry point for the SharePoint File Downloader application.
 """
 import os
 import sys
+import logging
 from src.graph_client import GraphClient
 from src.config import DOWNLOAD_PATH
 
@@ -56,16 +57,12 @@ def list_drives(client, show_onedrive=True, show_sharepoint=True):
                 sites_response = client._make_request("sites?search=*")
                 sites = sites_response.get("value", [])
 
-                # For each site, try to get its drives
-                for site in sites:
-                    site_id = site.get("id")
-                    try:
-                        site_drives_response = client._make_request(f"sites/{site_id}/drives")
-                        site_drives = site_drives_response.get("value", [])
-                        all_drives.extend(site_drives)
-                    except Exception:
-                        # Skip sites that we can't access
-                        pass
+                # Get the drives of all sites in as few round trips as possible
+                responses = client.batch_request([f"sites/{site.get('id')}/drives" for site in sites])
+                for response in responses:
+                    # Skip sites that we can't access
+                    if response.get("status") == 200:
+                        all_drives.extend(response.get("body", {}).get("value", []))
             except Exception as e:
                 print(f"Error getting SharePoint sites: {str(e)}")
 
@@ -125,156 +122,159 @@ def list_drives(client, show_onedrive=True, show_sharepoint=True):
         print(f"Error listing drives: {str(e)}")
         return None, None
 
-def browse_items(client, drive_id, item_id="root", path=""):
-    """Browse items in a drive or folder."""
-    try:
-        items_response = client.get_drive_items(drive_id, item_id)
-        items = items_response.get("value", [])
-
-        if not items:
-            print("\nNo items found in this location.")
-            return
-
-        # Separate folders and files
-        folders = [item for item in items if "folder" in item]
-        files = [item for item in items if "folder" not in item]
-
-        # Sort alphabetically
-        folders.sort(key=lambda x: x.get("name", "").lower())
-        files.sort(key=lambda x: x.get("name", "").lower())
-
-        # Combine for display
-        all_items = folders + files
-
-        print(f"\nItems in {path or 'root'}:")
-        item_options = []
-
-        for item in all_items:
-            name = item.get("name", "")
-            size = item.get("size", 0)
-            item_type = "📁 " if "folder" in item else "📄 "
+def browse_items(client, drive_id):
+    """
+    Browse items in a drive, starting at its root.
+    Returns when the user goes back from the root or asks for the main menu.
+    """
+    # Folders from the root down to the one being shown, as (item id, path)
+    stack = [("root", "")]
 
-            # Format size for files
-            if "folder" not in item:
-                if size < 1024:
-                    size_str = f"{size} B"
-                elif size < 1024 * 1024:
-                    size_str = f"{size/1024:.1f} KB"
+    while True:
+        item_id, path = stack[-1]
+        try:
+            items_response = client.get_drive_items(drive_id, item_id)
+            items = items_response.get("value", [])
+
+            if not items:
+                print("\nNo items found in this location.")
+                # Back to the parent folder, or from the root back to drive selection
+                if len(stack) == 1:
+                    return
+                stack.pop()
+                continue
+
+            # Separate folders and files
+            folders = [item for item in items if "folder" in item]
+            files = [item for item in items if "folder" not in item]
+
+            # Sort alphabetically
+            folders.sort(key=lambda x: x.get("name", "").lower())
+            files.sort(key=lambda x: x.get("name", "").lower())
+
+            # Combine for display
+            all_items = folders + files
+
+            # Fetch the subfolders while the user reads the menu, so opening one is instant
+            client.prefetch_drive_items(drive_id, folders)
+
+            print(f"\nItems in {path or 'root'}:")
+            item_options = []
+
+            for item in all_items:
+                name = item.get("name", "")
+                size = item.get("size", 0)
+                item_type = "📁 " if "folder" in item else "📄 "
+
+                # Format size for files
+                if "folder" not in item:
+                    if size < 1024:
+                        size_str = f"{size} B"
+                    elif size < 1024 * 1024:
+                        size_str = f"{size/1024:.1f} KB"
+                    else:
+                        size_str = f"{size/(1024*1024):.1f} MB"
+                    item_options.append(f"{item_type}{name} ({size_str})")
                 else:
-                    size_str = f"{size/(1024*1024):.1f} MB"
-                item_options.append(f"{item_type}{name} ({size_str})")
-            else:
-                item_options.append(f"{item_type}{name}")
-
-        # Add navigation options
-        item_options.append("⬆️ Go back")
-        item_options.append("💾 Download current folder")
-        item_options.append("🏠 Return to main menu")
-        item_options.append("❌ Exit")
-
-        choice = display_menu(item_options)
-
-        if choice <= len(all_items):
-            # Selected an item
-            selected_item = all_items[choice - 1]
-            selected_name = selected_item.get("name", "")
-            selected_id = selected_item.get("id", "")
-
-            if "folder" in selected_item:
-                # Navigate into folder
-                new_path = f"{path}/{selected_name}" if path else selected_name
-                browse_items(client, drive_id, selected_id, new_path)
-            else:
-                # Download file
-                print(f"\nDownloading {selected_name}...")
-                relative_path = path.lstrip("/") if path else ""
-                client.download_file(drive_id, selected_id, selected_name, relative_path)
-                print(f"\nFile downloaded to: {os.path.join(DOWNLOAD_PATH, relative_path, selected_name)}")
-
-                # Return to the same folder
-                browse_items(client, drive_id, item_id, path)
-
-        elif choice == len(all_items) + 1:
-            # Go back
-            if path:
-                # Go up one level
-                parent_path = "/".join(path.split("/")[:-1])
-                parent_id = "root"
-
-                if parent_path:
-                    # Need to get the parent folder's ID
-                    parent_parts = parent_path.split("/")
-                    current_id = "root"
-
-                    for part in parent_parts:
-                        items_response = client.get_drive_items(drive_id, current_id)
-                        items = items_response.get("value", [])
-                        for item in items:
-                            if item.get("name") == part and "folder" in item:
-                                current_id = item.get("id")
-                                break
-
-                    parent_id = current_id
-
-                browse_items(client, drive_id, parent_id, parent_path)
-            else:
-                # At root, go back to drive selection
-                main()
-
-        elif choice == len(all_items) + 2:
-            # Download current folder
-            print(f"\nDownloading entire folder: {path or 'root'}...")
-            folder_name = path.split("/")[-1] if path else "root"
-            relative_path = "/".join(path.split("/")[:-1]) if path else ""
-            relative_path = relative_path.lstrip("/")
-
-            client.download_folder(drive_id, item_id, folder_name, relative_path)
-            print(f"\nFolder downloaded to: {os.path.join(DOWNLOAD_PATH, relative_path, folder_name)}")
-
-            # Return to the same folder
-            browse_items(client, drive_id, item_id, path)
-
-        elif choice == len(all_items) + 3:
-            # Return to main menu
-            main()
+                    item_options.append(f"{item_type}{name}")
+
+            # Add navigation options
+            item_options.append("⬆️ Go back")
+            item_options.append("💾 Download current folder")
+            item_options.append("🏠 Return to main menu")
+            item_options.append("❌ Exit")
+
+            choice = display_menu(item_options)
+
+            if choice <= len(all_items):
+                # Selected an item
+                selected_item = all_items[choice - 1]
+                selected_name = selected_item.get("name", "")
+                selected_id = selected_item.get("id", "")
+
+                if "folder" in selected_item:
+                    # Navigate into folder
+                    new_path = f"{path}/{selected_name}" if path else selected_name
+                    stack.append((selected_id, new_path))
+                else:
+                    # Download file, then show the same folder again
+                    print(f"\nDownloading {selected_name}...")
+                    relative_path = path.lstrip("/") if path else ""
+                    client.download_file(drive_id, selected_id, selected_name, relative_path)
+                    print(f"\nFile downloaded to: {os.path.join(DOWNLOAD_PATH, relative_path, selected_name)}")
+
+            elif choice == len(all_items) + 1:
+                # Go back: up one level, or from the root back to drive selection
+                if len(stack) == 1:
+                    return
+                stack.pop()
+
+            elif choice == len(all_items) + 2:
+                # Download current folder, then show it again
+                print(f"\nDownloading entire folder: {path or 'root'}...")
+                folder_name = path.split("/")[-1] if path else "root"
+                relative_path = "/".join(path.split("/")[:-1]) if path else ""
+                relative_path = relative_path.lstrip("/")
+
+                client.download_folder(drive_id, item_id, folder_name, relative_path)
+                print(f"\nFolder downloaded to: {os.path.join(DOWNLOAD_PATH, relative_path, folder_name)}")
+
+            elif choice == len(all_items) + 3:
+                # Return to main menu
+                return
 
-        else:
-            # Exit
-            print("\nExiting application. Downloaded files are in the 'downloads' folder.")
-            sys.exit(0)
+            else:
+                # Exit
+                print("\nExiting application. Downloaded files are in the 'downloads' folder.")
+                sys.exit(0)
 
-    except Exception as e:
-        print(f"Error browsing items: {str(e)}")
-        input("\nPress Enter to continue...")
-        main()
+        except Exception as e:
+            print(f"Error browsing items: {str(e)}")
+            input("\nPress Enter to continue...")
+            return
 
 def main():
     """Main function to run the application."""
-    print_separator()
-    print("SharePoint File Downloader".center(80))
-    print_separator()
-    print("This application connects to Microsoft 365 and allows you to download")
-    print("files from SharePoint and OneDrive for Business.")
-    print_separator()
+    client = None
 
     try:
-        # Initialize the Graph client
-        client = GraphClient()
+        # Each pass selects a drive and browses it; browsing returns here for the main menu
+        while True:
+            print_separator()
+            print("SharePoint File Downloader".center(80))
+            print_separator()
+            print("This application connects to Microsoft 365 and allows you to download")
+            print("files from SharePoint and OneDrive for Business.")
+            print_separator()
 
-        # List drives and let user select one
-        drive_id, drive_name = list_drives(client)
+            try:
+                # Initialize the Graph client once; later passes reuse its token and connections
+                if client is None:
+                    client = GraphClient()
 
-        if drive_id:
-            print(f"\nSelected drive: {drive_name}")
+                # List drives and let user select one
+                drive_id, drive_name = list_drives(client)
 
-            # Browse items in the selected drive
-            browse_items(client, drive_id)
-        else:
-            print("\nNo drive selected. Exiting.")
+                if drive_id:
+                    print(f"\nSelected drive: {drive_name}")
 
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
-        input("\nPress Enter to exit...")
+                    # Browse items in the selected drive
+                    browse_items(client, drive_id)
+                else:
+                    print("\nNo drive selected. Exiting.")
+                    return
+
+            except Exception as e:
+                print(f"An error occurred: {str(e)}")
+                input("\nPress Enter to exit...")
+                return
+    finally:
+        # Don't let queued folder prefetches hold up the exit
+        if client is not None:
+            client.close()
 
 if __name__ == "__main__":
+    # Show GraphClient's download messages
+    logging.basicConfig(stream=sys.stdout, format="%(message)s")
+    logging.getLogger("src").setLevel(logging.INFO)
     main()
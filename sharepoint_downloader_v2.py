@@ -3,6 +3,7 @@ SharePoint-specific downloader with improved site discovery.
 """
 import os
 import sys
+import logging
 from src.graph_client import GraphClient
 from src.config import DOWNLOAD_PATH
 
@@ -73,128 +74,113 @@ def list_all_drives(client):
         print(f"Error listing drives: {str(e)}")
         return None, None
 
-def browse_items(client, drive_id, item_id="root", path=""):
-    """Browse items in a drive or folder."""
-    try:
-        items_response = client.get_drive_items(drive_id, item_id)
-        items = items_response.get("value", [])
-        
-        if not items:
-            print("\nNo items found in this location.")
-            return
-        
-        # Separate folders and files
-        folders = [item for item in items if "folder" in item]
-        files = [item for item in items if "folder" not in item]
-        
-        # Sort alphabetically
-        folders.sort(key=lambda x: x.get("name", "").lower())
-        files.sort(key=lambda x: x.get("name", "").lower())
-        
-        # Combine for display
-        all_items = folders + files
-        
-        print(f"\nItems in {path or 'root'}:")
-        item_options = []
-        
-        for item in all_items:
-            name = item.get("name", "")
-            size = item.get("size", 0)
-            item_type = "📁 " if "folder" in item else "📄 "
-            
-            # Format size for files
-            if "folder" not in item:
-                if size < 1024:
-                    size_str = f"{size} B"
-                elif size < 1024 * 1024:
-                    size_str = f"{size/1024:.1f} KB"
+def browse_items(client, drive_id):
+    """
+    Browse items in a drive, starting at its root.
+    Returns when the user goes back from the root or asks for the main menu.
+    """
+    # Folders from the root down to the one being shown, as (item id, path)
+    stack = [("root", "")]
+
+    while True:
+        item_id, path = stack[-1]
+        try:
+            items_response = client.get_drive_items(drive_id, item_id)
+            items = items_response.get("value", [])
+
+            if not items:
+                print("\nNo items found in this location.")
+                # Back to the parent folder, or from the root back to the main menu
+                if len(stack) == 1:
+                    return
+                stack.pop()
+                continue
+
+            # Separate folders and files
+            folders = [item for item in items if "folder" in item]
+            files = [item for item in items if "folder" not in item]
+
+            # Sort alphabetically
+            folders.sort(key=lambda x: x.get("name", "").lower())
+            files.sort(key=lambda x: x.get("name", "").lower())
+
+            # Combine for display
+            all_items = folders + files
+
+            print(f"\nItems in {path or 'root'}:")
+            item_options = []
+
+            for item in all_items:
+                name = item.get("name", "")
+                size = item.get("size", 0)
+                item_type = "📁 " if "folder" in item else "📄 "
+
+                # Format size for files
+                if "folder" not in item:
+                    if size < 1024:
+                        size_str = f"{size} B"
+                    elif size < 1024 * 1024:
+                        size_str = f"{size/1024:.1f} KB"
+                    else:
+                        size_str = f"{size/(1024*1024):.1f} MB"
+                    item_options.append(f"{item_type}{name} ({size_str})")
                 else:
-                    size_str = f"{size/(1024*1024):.1f} MB"
-                item_options.append(f"{item_type}{name} ({size_str})")
-            else:
-                item_options.append(f"{item_type}{name}")
-        
-        # Add navigation options
-        item_options.append("⬆️ Go back")
-        item_options.append("💾 Download current folder")
-        item_options.append("🏠 Return to main menu")
-        item_options.append("❌ Exit")
-        
-        choice = display_menu(item_options)
-        
-        if choice <= len(all_items):
-            # Selected an item
-            selected_item = all_items[choice - 1]
-            selected_name = selected_item.get("name", "")
-            selected_id = selected_item.get("id", "")
-            
-            if "folder" in selected_item:
-                # Navigate into folder
-                new_path = f"{path}/{selected_name}" if path else selected_name
-                browse_items(client, drive_id, selected_id, new_path)
-            else:
-                # Download file
-                print(f"\nDownloading {selected_name}...")
-                relative_path = path.lstrip("/") if path else ""
-                client.download_file(drive_id, selected_id, selected_name, relative_path)
-                print(f"\nFile downloaded to: {os.path.join(DOWNLOAD_PATH, relative_path, selected_name)}")
-                
-                # Return to the same folder
-                browse_items(client, drive_id, item_id, path)
-        
-        elif choice == len(all_items) + 1:
-            # Go back
-            if path:
-                # Go up one level
-                parent_path = "/".join(path.split("/")[:-1])
-                parent_id = "root"
-                
-                if parent_path:
-                    # Need to get the parent folder's ID
-                    parent_parts = parent_path.split("/")
-                    current_id = "root"
-                    
-                    for part in parent_parts:
-                        items_response = client.get_drive_items(drive_id, current_id)
-                        items = items_response.get("value", [])
-                        for item in items:
-                            if item.get("name") == part and "folder" in item:
-                                current_id = item.get("id")
-                                break
-                    
-                    parent_id = current_id
-                
-                browse_items(client, drive_id, parent_id, parent_path)
+                    item_options.append(f"{item_type}{name}")
+
+            # Add navigation options
+            item_options.append("⬆️ Go back")
+            item_options.append("💾 Download current folder")
+            item_options.append("🏠 Return to main menu")
+            item_options.append("❌ Exit")
+
+            choice = display_menu(item_options)
+
+            if choice <= len(all_items):
+                # Selected an item
+                selected_item = all_items[choice - 1]
+                selected_name = selected_item.get("name", "")
+                selected_id = selected_item.get("id", "")
+
+                if "folder" in selected_item:
+                    # Navigate into folder
+                    new_path = f"{path}/{selected_name}" if path else selected_name
+                    stack.append((selected_id, new_path))
+                else:
+                    # Download file, then show the same folder again
+                    print(f"\nDownloading {selected_name}...")
+                    relative_path = path.lstrip("/") if path else ""
+                    client.download_file(drive_id, selected_id, selected_name, relative_path)
+                    print(f"\nFile downloaded to: {os.path.join(DOWNLOAD_PATH, relative_path, selected_name)}")
+
+            elif choice == len(all_items) + 1:
+                # Go back: up one level, or from the root back to the main menu
+                if len(stack) == 1:
+                    return
+                stack.pop()
+
+            elif choice == len(all_items) + 2:
+                # Download current folder, then show it again
+                print(f"\nDownloading entire folder: {path or 'root'}...")
+                folder_name = path.split("/")[-1] if path else "root"
+                relative_path = "/".join(path.split("/")[:-1]) if path else ""
+                relative_path = relative_path.lstrip("/")
+
+                client.download_folder(drive_id, item_id, folder_name, relative_path)
+                print(f"\nFolder downloaded to: {os.path.join(DOWNLOAD_PATH, relative_path, folder_name)}")
+
+            elif choice == len(all_items) + 3:
+                # Return to main menu
+                return
+
             else:
-                # At root, go back to drive selection
-                main()
-        
-        elif choice == len(all_items) + 2:
-            # Download current folder
-            print(f"\nDownloading entire folder: {path or 'root'}...")
-            folder_name = path.split("/")[-1] if path else "root"
-            relative_path = "/".join(path.split("/")[:-1]) if path else ""
-            relative_path = relative_path.lstrip("/")
-            
-            client.download_folder(drive_id, item_id, folder_name, relative_path)
-            print(f"\nFolder downloaded to: {os.path.join(DOWNLOAD_PATH, relative_path, folder_name)}")
-            
-            # Return to the same folder
-            browse_items(client, drive_id, item_id, path)
-        
-        elif choice == len(all_items) + 3:
-            # Return to main menu
-            main()
-        
-        else:
-            # Exit
-            print("\nExiting application. Downloaded files are in the 'downloads' folder.")
-            sys.exit(0)
-    
-    except Exception as e:
-        print(f"Error browsing items: {str(e)}")
-        input("\nPress Enter to continue...")
-        main()
+                # Exit
+                print("\nExiting application. Downloaded files are in the 'downloads' folder.")
+                sys.exit(0)
+
+        except Exception as e:
+            print(f"Error browsing items: {str(e)}")
+            input("\nPress Enter to continue...")
+            return
 
 def download_all_content(client):
     """Download all content from all drives automatically."""
@@ -238,7 +224,7 @@ def download_all_content(client):
             os.makedirs(drive_folder, exist_ok=True)
             
             # Download all content from the drive
-            download_folder_recursive(client, drive_id, "root", "", drive_name)
+            download_drive_tree(client, drive_id, drive_name)
         
         print("\nDownload completed successfully!")
         print(f"All files have been downloaded to: {os.path.abspath(DOWNLOAD_PATH)}")
@@ -247,35 +233,33 @@ def download_all_content(client):
         print(f"An error occurred: {str(e)}")
         input("\nPress Enter to continue...")
 
-def download_folder_recursive(client, drive_id, folder_id, path, drive_name):
-    """Recursively download a folder and all its contents."""
+def download_drive_tree(client, drive_id, drive_name):
+    """Download all folders and files in a drive."""
     try:
-        # Get items in the current folder
-        items_response = client.get_drive_items(drive_id, folder_id)
-        items = items_response.get("value", [])
-        
-        if not items:
-            print(f"No items found in {path or 'root'}")
-            return
-        
-        # Process each item
-        for item in items:
-            item_name = item.get("name", "")
-            item_id = item.get("id", "")
-            
-            # Build the current path for display
-            current_path = f"{path}/{item_name}" if path else item_name
-            
+        # One listing of the whole drive, parents before their contents
+        tree = client.get_drive_tree(drive_id)
+    except Exception as e:
+        print(f"Error processing root: {str(e)}")
+        return
+
+    if not tree:
+        print("No items found in root")
+        return
+
+    for path, item in tree:
+        item_name = item.get("name", "")
+        item_id = item.get("id", "")
+
+        # Build the current path for display
+        current_path = f"{path}/{item_name}" if path else item_name
+
+        try:
             if "folder" in item:
-                # It's a folder - process recursively
                 print(f"Processing folder: {current_path}")
-                
+
                 # Create the folder locally
                 folder_path = os.path.join(DOWNLOAD_PATH, drive_name, path, item_name)
                 os.makedirs(folder_path, exist_ok=True)
-                
-                # Download its contents
-                download_folder_recursive(client, drive_id, item_id, current_path, drive_name)
             else:
                 # It's a file - download it
                 size = item.get("size", 0)
@@ -285,65 +269,78 @@ def download_folder_recursive(client, drive_id, folder_id, path, drive_name):
                     size_str = f"{size/1024:.1f} KB"
                 else:
                     size_str = f"{size/(1024*1024):.1f} MB"
-                
+
                 print(f"Downloading file: {current_path} ({size_str})")
-                
-                # Prepare the local path
-                local_folder = os.path.join(DOWNLOAD_PATH, drive_name, path)
-                os.makedirs(local_folder, exist_ok=True)
-                
-                # Download the file
+
+                # Download the file (download_file creates its folder if needed)
                 client.download_file(drive_id, item_id, item_name, os.path.join(drive_name, path))
-    
-    except Exception as e:
-        print(f"Error processing {path or 'root'}: {str(e)}")
+
+        except Exception as e:
+            print(f"Error processing {current_path}: {str(e)}")
 
 def main():
     """Main function to run the application."""
-    print_separator()
-    print("SharePoint/OneDrive File Downloader".center(80))
-    print_separator()
-    print("This application connects to Microsoft 365 and allows you to download")
-    print("files from SharePoint and OneDrive for Business.")
-    print_separator()
-    
+    client = None
+
     try:
-        # Initialize the Graph client
-        client = GraphClient()
+        # Each pass shows the main menu; browsing returns here for it
+        while True:
+            print_separator()
+            print("SharePoint/OneDrive File Downloader".center(80))
+            print_separator()
+            print("This application connects to Microsoft 365 and allows you to download")
+            print("files from SharePoint and OneDrive for Business.")
+            print_separator()
+    
+            try:
+                # Initialize the Graph client once; later passes reuse its token and connections
+                if client is None:
+                    client = GraphClient()
         
-        # Show menu options
-        print("\nWhat would you like to do?")
-        options = [
-            "Browse drives and download files interactively",
-            "Download all content automatically",
-            "Exit"
-        ]
+                # Show menu options
+                print("\nWhat would you like to do?")
+                options = [
+                    "Browse drives and download files interactively",
+                    "Download all content automatically",
+                    "Exit"
+                ]
         
-        choice = display_menu(options)
+                choice = display_menu(options)
         
-        if choice == 1:
-            # Browse and download interactively
-            drive_id, drive_name = list_all_drives(client)
+                if choice == 1:
+                    # Browse and download interactively
+                    drive_id, drive_name = list_all_drives(client)
             
-            if drive_id:
-                print(f"\nSelected drive: {drive_name}")
+                    if drive_id:
+                        print(f"\nSelected drive: {drive_name}")
                 
-                # Browse items in the selected drive
-                browse_items(client, drive_id)
-            else:
-                print("\nNo drive selected. Exiting.")
+                        # Browse items in the selected drive
+                        browse_items(client, drive_id)
+                    else:
+                        print("\nNo drive selected. Exiting.")
+                        return
         
-        elif choice == 2:
-            # Download all content
-            download_all_content(client)
+                elif choice == 2:
+                    # Download all content
+                    download_all_content(client)
+                    return
         
-        else:
-            # Exit
-            print("\nExiting application.")
+                else:
+                    # Exit
+                    print("\nExiting application.")
+                    return
     
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
-        input("\nPress Enter to exit...")
+            except Exception as e:
+                print(f"An error occurred: {str(e)}")
+                input("\nPress Enter to exit...")
+                return
+    finally:
+        # Don't let queued folder prefetches hold up the exit
+        if client is not None:
+            client.close()
 
 if __name__ == "__main__":
+    # Show GraphClient's download messages
+    logging.basicConfig(stream=sys.stdout, format="%(message)s")
+    logging.getLogger("src").setLevel(logging.INFO)
     main()
@@ -3,6 +3,8 @@ Authentication module for Microsoft Graph API using MSAL.
 """
 import msal
 import os
+import tempfile
+import threading
 from .config import CLIENT_ID, AUTHORITY, SCOPE, TOKEN_CACHE_FILE
 
 class GraphAuth:
@@ -17,6 +19,9 @@ class GraphAuth:
         self.token_cache_file = TOKEN_CACHE_FILE
         self.app = self._create_app()
         self.access_token = None
+        # Download threads share this object; only one of them refreshes the token
+        # or writes the cache at a time
+        self._lock = threading.RLock()
 
     def _create_app(self):
         """Create the MSAL application with token cache."""
@@ -37,10 +42,25 @@ class GraphAuth:
         return app
 
     def _save_cache(self):
-        """Save the token cache to file."""
-        if self.app.token_cache.has_state_changed:
-            with open(self.token_cache_file, 'w') as f:
-                f.write(self.app.token_cache.serialize())
+        """
+        Save the token cache to file, if it changed.
+        Written to a temporary file that replaces the cache in one step, so an interrupted
+        save can't leave a truncated cache behind (which would force a new sign-in).
+        """
+        cache = self.app.token_cache
+        with self._lock:
+            if cache.has_state_changed:
+                fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(self.token_cache_file),
+                                                 suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'w') as f:
+                        f.write(cache.serialize())
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(temp_file, self.token_cache_file)
+                except BaseException:
+                    os.unlink(temp_file)
+                    raise
 
     def get_token(self):
         """
@@ -53,6 +73,8 @@ class GraphAuth:
             result = self.app.acquire_token_silent(self.scope, account=accounts[0])
             if result:
                 self.access_token = result['access_token']
+                # A silent refresh can rotate the refresh token; saved only if the cache changed
+                self._save_cache()
                 return self.access_token
 
         # If no token in cache or expired, try interactive login
@@ -78,7 +100,10 @@ class GraphAuth:
     def get_headers(self):
         """Get the authorization headers for API requests."""
         if not self.access_token:
-            self.get_token()
+            with self._lock:
+                # Another thread may have got a new token while this one waited
+                if not self.access_token:
+                    self.get_token()
 
         return {
             'Authorization': f'Bearer {self.access_token}',
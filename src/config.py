@@ -30,3 +30,15 @@ os.makedirs(DOWNLOAD_PATH, exist_ok=True)
 
 # API endpoints
 GRAPH_BASE_URL = "https://graph.microsoft.com/v1.0"
+
+# How long folder listings are reused before they are fetched again, in seconds
+LISTING_CACHE_TTL = 60
+
+# Requests to Graph made in parallel; Graph throttles clients that go much higher.
+# Files downloaded at the same time (download_all.py lists folders on the same workers)
+MAX_DOWNLOAD_WORKERS = 8
+# SharePoint sites whose drives are fetched at the same time
+MAX_SITE_WORKERS = 8
+
+# Subfolder listings fetched in the background while a folder's menu is shown, at most
+MAX_PREFETCH_FOLDERS = 20
@@ -2,12 +2,62 @@
 Microsoft Graph API client for accessing SharePoint/OneDrive files.
 """
 import requests
+from requests.adapters import HTTPAdapter
 import os
 import json
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
-from .config import GRAPH_BASE_URL, DOWNLOAD_PATH
+from .config import (GRAPH_BASE_URL, DOWNLOAD_PATH, LISTING_CACHE_TTL, MAX_PREFETCH_FOLDERS,
+                     MAX_DOWNLOAD_WORKERS)
 from .auth import GraphAuth
 
+# Graph accepts at most this many sub-requests in one $batch call
+MAX_BATCH_REQUESTS = 20
+
+# Only the fields the folder listings are used for, in pages as large as Graph allows
+LISTING_PARAMS = {"$select": "id,name,size,file,folder", "$top": 999}
+
+logger = logging.getLogger(__name__)
+
+def _part_offset(part_path, tag_path, remote_size, remote_tag):
+    """
+    Get the size of a .part file left by an earlier download, to resume from, or 0.
+    The .tag file next to it holds the eTag of the version being downloaded; a .part
+    file of another (or an unknown) version is deleted instead of resumed.
+    """
+    if not os.path.exists(part_path):
+        return 0
+    try:
+        with open(tag_path) as f:
+            part_tag = f.read()
+    except FileNotFoundError:
+        part_tag = None
+    offset = os.path.getsize(part_path)
+    if remote_tag and part_tag == remote_tag and remote_size and offset < remote_size:
+        return offset
+    _remove_files(part_path, tag_path)
+    return 0
+
+def _write_part_tag(tag_path, tag):
+    """Record which version of a file its .part file holds."""
+    if tag:
+        with open(tag_path, "w") as f:
+            f.write(tag)
+    else:
+        _remove_files(tag_path)
+
+def _remove_files(*paths):
+    """Delete files, ignoring ones that don't exist."""
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
 class GraphClient:
     """
     Client for interacting with Microsoft Graph API to access SharePoint/OneDrive files.
@@ -17,13 +67,28 @@ class GraphClient:
         self.auth = GraphAuth()
         self.base_url = GRAPH_BASE_URL
         self.download_path = DOWNLOAD_PATH
+        # One session for all requests, so connections (and their TLS handshakes) are reused;
+        # the pool is large enough for parallel downloads plus background prefetches
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+        # Local folders already created this run, so downloading many files into the
+        # same folder only creates it once (nothing here deletes folders)
+        self._created_dirs = set()
+        # (drive id, folder id) -> (expiry time, listing), so revisiting a folder soon after
+        # doesn't fetch it again; kept in expiry order so expired entries are dropped from the
+        # front. Prefetch threads add to it too, hence the lock.
+        self._listing_cache = {}
+        self._listing_cache_lock = threading.Lock()
+        # Listings being fetched in the background, by the same key as the listing cache
+        self._prefetching = {}
+        self._prefetch_pool = None  # Created on first prefetch
 
     def _make_request(self, endpoint, method="GET", params=None, data=None):
         """Make a request to the Microsoft Graph API."""
         url = f"{self.base_url}/{endpoint}"
         headers = self.auth.get_headers()
 
-        response = requests.request(
+        response = self.session.request(
             method=method,
             url=url,
             headers=headers,
@@ -36,7 +101,7 @@ class GraphClient:
             # Token expired, get a new one
             self.auth.access_token = None
             headers = self.auth.get_headers()
-            response = requests.request(
+            response = self.session.request(
                 method=method,
                 url=url,
                 headers=headers,
@@ -69,12 +134,171 @@ class GraphClient:
                 except Exception as final_e:
                     raise Exception(f"Failed to get drives: {str(final_e)}")
 
-    def get_drive_items(self, drive_id, item_id="root"):
-        """Get items in a drive or folder."""
-        return self._make_request(f"drives/{drive_id}/items/{item_id}/children")
+    def get_drive_items(self, drive_id, item_id="root", cache=True):
+        """
+        Get items in a drive or folder.
+        Listings are reused for LISTING_CACHE_TTL seconds. Walks that list every folder once
+        pass cache=False, so their listings aren't kept in memory.
+        Prefetches of other folders that haven't started yet are cancelled, since the
+        folder they were fetched for has been left.
+        """
+        key = (drive_id, item_id)
+        self._cancel_prefetches(keep=key)
+        if not cache:
+            return self._fetch_listing(drive_id, item_id, cache=False)
+        response = self._cached_listing(key)
+        if response is None:
+            # Wait for a prefetch of this folder rather than fetching it twice
+            future = self._prefetching.get(key)
+            if future is not None:
+                try:
+                    response = future.result()
+                except Exception:
+                    # Fetched again below, so the error is reported to the caller
+                    response = None
+            if response is None:
+                response = self._fetch_listing(drive_id, item_id)
+        return response
+
+    def _cached_listing(self, key):
+        """Get a folder listing from the cache, or None if it isn't cached or has expired."""
+        with self._listing_cache_lock:
+            cached = self._listing_cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        return None
+
+    def _fetch_listing(self, drive_id, item_id, cache=True):
+        """Fetch a folder listing (all pages of it) and cache it, unless cache is False."""
+        response = {"value": self._get_all_pages(f"drives/{drive_id}/items/{item_id}/children",
+                                                 LISTING_PARAMS)}
+        if cache:
+            now = time.monotonic()
+            with self._listing_cache_lock:
+                # Drop expired entries, oldest first
+                while self._listing_cache:
+                    oldest = next(iter(self._listing_cache))
+                    if self._listing_cache[oldest][0] > now:
+                        break
+                    del self._listing_cache[oldest]
+                # Re-inserted at the end, keeping the cache in expiry order
+                self._listing_cache.pop((drive_id, item_id), None)
+                self._listing_cache[(drive_id, item_id)] = (now + LISTING_CACHE_TTL, response)
+        return response
+
+    def _get_all_pages(self, endpoint, params=None):
+        """Get the items of every page of a collection, following @odata.nextLink."""
+        items = []
+        while endpoint:
+            response = self._make_request(endpoint, params=params)
+            items.extend(response.get("value", []))
+            # The next link already carries the query
+            next_link = response.get("@odata.nextLink")
+            endpoint = next_link[len(self.base_url) + 1:] if next_link else None
+            params = None
+        return items
+
+    def prefetch_drive_items(self, drive_id, folders):
+        """
+        Start fetching the listings of folders (up to MAX_PREFETCH_FOLDERS) in the background,
+        so they are already cached if one of them is opened next. Failures are ignored here;
+        get_drive_items fetches the folder again.
+        """
+        if self._prefetch_pool is None:
+            self._prefetch_pool = ThreadPoolExecutor(max_workers=4)
+        for folder in folders[:MAX_PREFETCH_FOLDERS]:
+            key = (drive_id, folder.get("id"))
+            if key in self._prefetching or self._cached_listing(key) is not None:
+                continue
+            future = self._prefetch_pool.submit(self._fetch_listing, *key)
+            self._prefetching[key] = future
+            future.add_done_callback(lambda _, key=key: self._prefetching.pop(key, None))
+
+    def _cancel_prefetches(self, keep=None):
+        """Cancel the queued prefetches, except the one for the keep key."""
+        for key, future in list(self._prefetching.items()):
+            if key != keep:
+                future.cancel()
 
-    def download_file(self, drive_id, item_id, file_path, relative_path=""):
-        """Download a file from SharePoint/OneDrive."""
+    def close(self):
+        """
+        Stop background prefetching: queued listings are cancelled and running ones aren't
+        waited for, so exiting doesn't block on them.
+        """
+        if self._prefetch_pool is not None:
+            self._prefetch_pool.shutdown(wait=False, cancel_futures=True)
+            self._prefetch_pool = None
+
+    def batch_request(self, endpoints):
+        """
+        Send GET requests for several endpoints using $batch, MAX_BATCH_REQUESTS per call.
+        Returns the sub-responses (with 'status' and 'body') in the same order as endpoints.
+        """
+        results = []
+        for start in range(0, len(endpoints), MAX_BATCH_REQUESTS):
+            chunk = endpoints[start:start + MAX_BATCH_REQUESTS]
+            body = {"requests": [{"id": str(i), "method": "GET", "url": f"/{endpoint}"}
+                                 for i, endpoint in enumerate(chunk)]}
+            response = self._make_request("$batch", method="POST", data=body)
+            responses = {r.get("id"): r for r in response.get("responses", [])}
+            results.extend(responses.get(str(i), {}) for i in range(len(chunk)))
+        return results
+
+    def get_drive_tree(self, drive_id):
+        """
+        List a whole drive as (path, item) pairs for every folder and file in it,
+        where path is the item's parent folder relative to the drive root ('' for the root).
+        Uses the delta endpoint, which pages through the entire drive, so this takes
+        one request per page of items instead of one per folder. Folders come before
+        the items inside them.
+        """
+        params = {"$select": "id,name,size,file,folder,root,deleted,parentReference", "$top": 500}
+        items = self._get_all_pages(f"drives/{drive_id}/root/delta", params)
+
+        # Delta items don't include their path, so rebuild it from the parent ids
+        folders = {}
+        root_id = None
+        for item in items:
+            if "root" in item:
+                root_id = item.get("id")
+            elif "folder" in item and "deleted" not in item:
+                folders[item.get("id")] = item
+
+        paths = {root_id: ""}
+
+        def folder_path(folder_id):
+            # Walk up to the nearest folder with a known path, then fill in back down
+            chain = []
+            while folder_id not in paths:
+                folder = folders.get(folder_id)
+                if folder is None:
+                    return None
+                chain.append(folder)
+                folder_id = folder.get("parentReference", {}).get("id")
+            path = paths[folder_id]
+            for folder in reversed(chain):
+                path = f"{path}/{folder.get('name', '')}" if path else folder.get("name", "")
+                paths[folder.get("id")] = path
+            return path
+
+        tree = []
+        for item in items:
+            if "root" in item or "deleted" in item:
+                continue
+            parent_path = folder_path(item.get("parentReference", {}).get("id"))
+            if parent_path is not None:
+                tree.append((parent_path, item))
+
+        # Parents have shorter paths than their children
+        tree.sort(key=lambda entry: (entry[0].count("/") + bool(entry[0]), "folder" not in entry[1]))
+        return tree
+
+    def download_file(self, drive_id, item_id, file_path, relative_path="", progress=True):
+        """
+        Download a file from SharePoint/OneDrive.
+        Callers downloading on several threads pass progress=False, since their progress
+        bars would overwrite each other.
+        """
         # Get file metadata
         file_metadata = self._make_request(f"drives/{drive_id}/items/{item_id}")
 
@@ -85,54 +309,98 @@ class GraphClient:
 
         # Create local directory structure if it doesn't exist
         local_dir = os.path.join(self.download_path, relative_path)
-        os.makedirs(local_dir, exist_ok=True)
+        self._ensure_dir(local_dir)
 
         # Download the file
         local_file_path = os.path.join(local_dir, file_path)
 
+        # Data goes to a .part file that is renamed into place once complete, so an
+        # interrupted download never leaves a truncated file under the real name.
+        # A .part file left by an earlier attempt of the same version is resumed.
+        part_path = local_file_path + '.part'
+        tag_path = part_path + '.tag'
+        remote_size = file_metadata.get("size")
+        remote_tag = file_metadata.get("eTag")
+        offset = _part_offset(part_path, tag_path, remote_size, remote_tag)
+
         # Stream download with progress bar
-        response = requests.get(download_url, stream=True)
+        headers = {'Range': f'bytes={offset}-', 'If-Range': remote_tag} if offset else None
+        response = self.session.get(download_url, stream=True, headers=headers)
         response.raise_for_status()
+        if offset and response.status_code != 206:
+            # The file changed (If-Range) or the server ignored the range; it sent the whole file
+            offset = 0
 
-        file_size = int(response.headers.get('content-length', 0))
-        block_size = 1024  # 1 Kibibyte
+        file_size = offset + int(response.headers.get('content-length', 0))
+        block_size = 1024 * 1024  # 1 Mebibyte; small blocks cost a Python round trip each
 
-        print(f"Downloading: {file_path}")
-        with open(local_file_path, 'wb') as f, tqdm(
+        logger.info(f"Resuming: {file_path}" if offset else f"Downloading: {file_path}")
+        # Unbuffered, since the blocks are already large
+        with open(part_path, 'ab' if offset else 'wb', buffering=0) as f, tqdm(
             desc=file_path,
             total=file_size,
+            initial=offset,
             unit='iB',
             unit_scale=True,
             unit_divisor=1024,
+            disable=not progress,
         ) as bar:
+            if not offset:
+                _write_part_tag(tag_path, remote_tag)
             for data in response.iter_content(block_size):
                 size = f.write(data)
                 bar.update(size)
+            written = f.tell()
+            # On disk before the rename, so a crash can't leave a renamed but empty file
+            os.fsync(f.fileno())
+
+        if remote_size and written != remote_size:
+            # Most likely the file changed since the partial download; start over next time
+            _remove_files(part_path, tag_path)
+            raise Exception(f"Downloaded size {written} does not match expected size {remote_size}")
+        os.replace(part_path, local_file_path)
+        _remove_files(tag_path)
 
-        print(f"Downloaded: {local_file_path}")
+        logger.info(f"Downloaded: {local_file_path}")
         return local_file_path
 
+    def _ensure_dir(self, path):
+        """Create a local folder (and its parents) unless it was already created this run."""
+        if path not in self._created_dirs:
+            os.makedirs(path, exist_ok=True)
+            self._created_dirs.add(path)
+
     def download_folder(self, drive_id, item_id, folder_path, relative_path=""):
-        """Download a folder and its contents recursively."""
+        """
+        Download a folder and all its contents.
+        Folders are listed on this thread while up to MAX_DOWNLOAD_WORKERS files download
+        in parallel; the first download error is raised once the others have finished.
+        """
         # Create local directory
         local_dir = os.path.join(self.download_path, relative_path, folder_path)
-        os.makedirs(local_dir, exist_ok=True)
-
-        # Get folder contents
-        items = self.get_drive_items(drive_id, item_id)
-
-        # Process each item
-        for item in items.get("value", []):
-            item_name = item.get("name")
-            item_id = item.get("id")
-
-            if "folder" in item:
-                # Recursively download folder
-                new_relative_path = os.path.join(relative_path, folder_path)
-                self.download_folder(drive_id, item_id, item_name, new_relative_path)
-            else:
-                # Download file
-                new_relative_path = os.path.join(relative_path, folder_path)
-                self.download_file(drive_id, item_id, item_name, new_relative_path)
+
+        downloads = []
+        with ThreadPoolExecutor(max_workers=MAX_DOWNLOAD_WORKERS) as executor:
+            # Breadth-first over (folder id, folder path relative to the download path)
+            queue = deque([(item_id, os.path.join(relative_path, folder_path))])
+            while queue:
+                folder_id, folder_relative_path = queue.popleft()
+                self._ensure_dir(os.path.join(self.download_path, folder_relative_path))
+
+                # Get folder contents (each folder is listed once, so not cached)
+                items = self.get_drive_items(drive_id, folder_id, cache=False)
+
+                # Process each item
+                for item in items.get("value", []):
+                    item_name = item.get("name")
+
+                    if "folder" in item:
+                        queue.append((item.get("id"), os.path.join(folder_relative_path, item_name)))
+                    else:
+                        downloads.append(executor.submit(self.download_file, drive_id, item.get("id"),
+                                                         item_name, folder_relative_path, progress=False))
+
+        for future in downloads:
+            future.result()
 
         return local_dir